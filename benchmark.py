@@ -0,0 +1,441 @@
+""" benchmarks
+
+Times `read_namelist` and `save_namelist` on synthetic namelists, and
+compares the results with a baseline.
+
+Usage:
+    python benchmark.py [--quick] [--output results.json]
+                        [--baseline baseline.json] [--threshold 0.25]
+
+The results (time, throughput and peak memory of each case) are written
+to a JSON file, which can be used as the baseline of a later run.
+With a baseline, the exit code is 1 if any case is slower than the
+baseline by more than the threshold.
+
+The startup cases time `import fastnml` (with `python -X importtime`),
+and a small read and write, in a new interpreter. The exit code is also 1
+if those import any of the modules that are only needed by the f90nml
+parser or the workers.
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import multiprocessing as mp
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import fastnml
+from fastnml import read_namelist, save_namelist
+
+_value_types = ("float", "int", "bool", "str")
+
+
+###############################################################################
+def _format_value(value_type: str, rng: random.Random) -> str:
+    """A random namelist value of the given type."""
+
+    if value_type == "float":
+        return f"{rng.uniform(-1e6, 1e6):.17E}"
+    elif value_type == "int":
+        return f"{rng.randint(-(10**6), 10**6)}"
+    elif value_type == "bool":
+        return rng.choice(["T", "F"])
+    elif value_type == "str":
+        return f"'s{rng.randint(0, 10**6)}'"
+    raise ValueError(f"invalid value type: {value_type}")
+
+
+def generate_namelist(
+    filename: str,
+    *,
+    n_groups: int = 10,
+    n_arrays: int = 4,
+    array_length: int = 1000,
+    depth: int = 1,
+    value_types: Iterable[str] = ("float",),
+    fallback: float = 0.0,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """Write a synthetic namelist file.
+
+    Each namelist has `n_arrays` arrays of `array_length` elements, one element
+    per line, e.g. `v1(1)%v2(1)%x0(10) = 1.0,` for `depth=3`.
+
+    Args:
+        filename (str): the file to write.
+        n_groups (int, optional): the number of namelists. Defaults to 10.
+        n_arrays (int, optional): the number of arrays in each namelist. Defaults to 4.
+        array_length (int, optional): the number of elements of each array. Defaults to 1000.
+        depth (int, optional): the number of `%` levels of the paths. Defaults to 1.
+        value_types (Iterable[str], optional): the types of the arrays, used in turn:
+            "float", "int", "bool" or "str". Defaults to ("float",).
+        fallback (float, optional): the fraction of the lines that the simple
+            parser can't read (lists of values continued on the next line).
+            Defaults to 0.0.
+        seed (int, optional): the random seed. Defaults to 0.
+
+    Returns:
+        Dict[str, int]: the number of `groups`, `values` and `bytes` in the file.
+    """
+
+    rng = random.Random(seed)
+    value_types = list(value_types)
+    prefix = "".join(f"v{k}(1)%" for k in range(1, depth))
+    n_values = 0
+    with open(filename, "w") as f:
+        for g in range(n_groups):
+            lines = [f"&group{g % 8}\n"]
+            for a in range(n_arrays):
+                value_type = value_types[a % len(value_types)]
+                for i in range(1, array_length + 1):
+                    value = _format_value(value_type, rng)
+                    if fallback and rng.random() < fallback:
+                        lines.append(f" {prefix}l{a}_{i} = {value},\n   {value},\n")
+                        n_values += 2
+                    else:
+                        lines.append(f" {prefix}x{a}({i}) = {value},\n")
+                        n_values += 1
+            lines.append("/\n\n")
+            f.write("".join(lines))
+    return dict(groups=n_groups, values=n_values, bytes=os.path.getsize(filename))
+
+
+###############################################################################
+def measure(func: Callable, repeats: int = 3) -> Dict[str, float]:
+    """Time a function (best of `repeats`), and measure its peak memory
+    (in a separate run, with `tracemalloc`, for this process only).
+
+    Args:
+        func (Callable): the function to measure.
+        repeats (int, optional): the number of timed runs. Defaults to 3.
+
+    Returns:
+        Dict[str, float]: the `seconds` and `peak_memory` (bytes).
+    """
+
+    times = list()
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return dict(seconds=min(times), peak_memory=peak)
+
+
+def _result(name: str, params: dict, info: Dict[str, int], m: dict) -> dict:
+    """One entry of the results."""
+
+    return dict(
+        name=name,
+        params=params,
+        seconds=m["seconds"],
+        mb_per_s=info["bytes"] / 1e6 / m["seconds"],
+        values_per_s=info["values"] / m["seconds"],
+        peak_memory=m["peak_memory"],
+    )
+
+
+###############################################################################
+# the synthetic files: (name, generate_namelist arguments)
+_full_cases = [
+    ("groups", dict(n_groups=200, n_arrays=4, array_length=200)),
+    ("arrays", dict(n_groups=4, n_arrays=4, array_length=50000)),
+    ("depth", dict(n_groups=10, n_arrays=4, array_length=5000, depth=5)),
+    ("types", dict(n_groups=10, array_length=5000, value_types=_value_types)),
+    ("fallback", dict(n_groups=10, n_arrays=4, array_length=5000, fallback=0.001)),
+]
+_quick_cases = [
+    ("groups", dict(n_groups=40, n_arrays=2, array_length=100)),
+    ("arrays", dict(n_groups=2, n_arrays=2, array_length=5000)),
+    ("depth", dict(n_groups=4, n_arrays=2, array_length=1000, depth=5)),
+    ("types", dict(n_groups=4, array_length=1000, value_types=_value_types)),
+    ("fallback", dict(n_groups=4, n_arrays=2, array_length=1000, fallback=0.01)),
+]
+
+# the read modes: (name, read_namelist arguments)
+_read_modes = {
+    "f90nml": dict(simple=False),
+    "simple": dict(simple=True),
+    "hybrid": dict(simple=True, hybrid=True),
+}
+
+
+def run_benchmarks(
+    cases: List[Tuple[str, dict]],
+    modes: Iterable[str] = ("simple", "hybrid"),
+    threads: Iterable[int] = (0, 2),
+    repeats: int = 3,
+    directory: str = None,
+) -> List[dict]:
+    """Run the read and write benchmarks.
+
+    Args:
+        cases (List[Tuple[str, dict]]): the `(name, generate_namelist arguments)` of each file.
+        modes (Iterable[str], optional): the read modes ("f90nml", "simple", "hybrid").
+            Defaults to ("simple", "hybrid").
+        threads (Iterable[int], optional): the values of `n_threads`. Defaults to (0, 2).
+        repeats (int, optional): the number of timed runs of each case. Defaults to 3.
+        directory (str, optional): where to write the files. Defaults to a temporary directory.
+
+    Returns:
+        List[dict]: the results.
+    """
+
+    results = list()
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        for case, params in cases:
+            filename = os.path.join(tmp, f"{case}.nml")
+            info = generate_namelist(filename, **params)
+
+            for mode in modes:
+                for n_threads in threads:
+                    name = f"read/{case}/{mode}/{n_threads}"
+                    m = measure(
+                        lambda: read_namelist(
+                            filename, n_threads=n_threads, **_read_modes[mode]
+                        ),
+                        repeats,
+                    )
+                    results.append(_result(name, params, info, m))
+                    print(_report(results[-1]))
+
+            nml = read_namelist(filename, hybrid=True)
+            output = os.path.join(tmp, f"{case}.out.nml")
+            for n_threads in threads:
+                name = f"write/{case}/{n_threads}"
+                m = measure(
+                    lambda: save_namelist(nml, output, n_threads=n_threads), repeats
+                )
+                written = dict(info, bytes=os.path.getsize(output))
+                results.append(_result(name, params, written, m))
+                print(_report(results[-1]))
+
+    return results
+
+
+def _report(result: dict) -> str:
+    """One line of the report."""
+
+    return (
+        f"{result['name'].ljust(32)}{result['seconds']:10.4f} s"
+        f"{result['mb_per_s']:10.2f} MB/s{result['values_per_s']:14.0f} values/s"
+        f"{result['peak_memory'] / 1e6:10.1f} MB"
+    )
+
+
+###############################################################################
+# the modules that a read or write with the simple parser should not import
+_deferred_modules = ("f90nml", "multiprocessing", "concurrent.futures")
+
+# the startup cases: (name, code run in a new interpreter)
+_startup_cases = [
+    ("import", "import fastnml"),
+    (
+        "read",
+        "import fastnml\n"
+        "nml = fastnml.read_namelist({filename!r}, compact=True)\n"
+        "fastnml.save_namelist(nml, {output!r})",
+    ),
+]
+
+
+def measure_startup(code: str, repeats: int = 3) -> Dict[str, Any]:
+    """Run some code in a new interpreter (`python -X importtime`), best of `repeats`.
+
+    Args:
+        code (str): the code to run.
+        repeats (int, optional): the number of runs. Defaults to 3.
+
+    Returns:
+        Dict[str, Any]: the `seconds` the code took (including the imports),
+            the `import_seconds` of `import fastnml`, and the `deferred`
+            modules (see `_deferred_modules`) that were imported.
+    """
+
+    script = (
+        "import time\n_start = time.perf_counter()\n"
+        f"{code}\n"
+        "print(time.perf_counter() - _start)\n"
+        "import sys\n"
+        f"print(','.join(m for m in {_deferred_modules!r} if m in sys.modules))\n"
+    )
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(fastnml.__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+
+    times = list()
+    import_times = list()
+    for _ in range(repeats):
+        p = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", script],
+            capture_output=True,
+            text=True,
+            env=env,
+            check=True,
+        )
+        seconds, deferred = p.stdout.splitlines()[-2:]
+        times.append(float(seconds))
+        for line in p.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == "fastnml":
+                import_times.append(int(fields[1]) / 1e6)
+
+    return dict(
+        seconds=min(times),
+        import_seconds=min(import_times),
+        deferred=[m for m in deferred.split(",") if m],
+    )
+
+
+def run_startup_benchmarks(repeats: int = 3, directory: str = None) -> List[dict]:
+    """Run the startup benchmarks (see `_startup_cases`).
+
+    Args:
+        repeats (int, optional): the number of runs of each case. Defaults to 3.
+        directory (str, optional): where to write the files. Defaults to a temporary directory.
+
+    Returns:
+        List[dict]: the results.
+    """
+
+    results = list()
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        filename = os.path.join(tmp, "startup.nml")
+        output = os.path.join(tmp, "startup.out.nml")
+        generate_namelist(filename, n_groups=2, n_arrays=2, array_length=10, depth=2)
+        for case, code in _startup_cases:
+            m = measure_startup(code.format(filename=filename, output=output), repeats)
+            results.append(dict(name=f"startup/{case}", **m))
+            print(_report_startup(results[-1]))
+    return results
+
+
+def _report_startup(result: dict) -> str:
+    """One line of the report for a startup case."""
+
+    deferred = ",".join(result["deferred"])
+    return (
+        f"{result['name'].ljust(32)}{result['seconds']:10.4f} s"
+        f"{result['import_seconds'] * 1e3:10.2f} ms import"
+        + (f"  IMPORTS {deferred}" if deferred else "")
+    )
+
+
+###############################################################################
+def compare(
+    results: List[dict], baseline: List[dict], threshold: float = 0.25
+) -> List[dict]:
+    """Compare the results with a baseline.
+
+    Args:
+        results (List[dict]): the results (see `run_benchmarks`).
+        baseline (List[dict]): the baseline results (cases not in both are skipped).
+        threshold (float, optional): the fraction of slowdown that is a regression.
+            Defaults to 0.25.
+
+    Returns:
+        List[dict]: the `name`, `seconds`, `baseline` time, `ratio` and `regression`
+            flag of each case.
+    """
+
+    base = {r["name"]: r for r in baseline}
+    comparison = list()
+    for r in results:
+        b = base.get(r["name"])
+        if b is None:
+            continue
+        ratio = r["seconds"] / b["seconds"]
+        comparison.append(
+            dict(
+                name=r["name"],
+                seconds=r["seconds"],
+                baseline=b["seconds"],
+                ratio=ratio,
+                regression=ratio > 1.0 + threshold,
+            )
+        )
+    return comparison
+
+
+def _metadata() -> dict:
+    """The environment of the benchmarks."""
+
+    return dict(
+        fastnml=fastnml.__version__,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpu_count=mp.cpu_count(),
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="fastnml benchmarks")
+    parser.add_argument("--quick", action="store_true", help="small files")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with this JSON file")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="regression threshold"
+    )
+    parser.add_argument(
+        "--modes", default="simple,hybrid", help="read modes (f90nml,simple,hybrid)"
+    )
+    parser.add_argument("--threads", default="0,2", help="values of n_threads")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case")
+    parser.add_argument(
+        "--no-startup", action="store_true", help="skip the startup benchmarks"
+    )
+    args = parser.parse_args(argv)
+
+    status = 0
+    results = list()
+    if not args.no_startup:
+        results.extend(run_startup_benchmarks(args.repeats))
+        if any(r["deferred"] for r in results):
+            status = 1
+
+    results += run_benchmarks(
+        _quick_cases if args.quick else _full_cases,
+        modes=args.modes.split(","),
+        threads=[int(n) for n in args.threads.split(",")],
+        repeats=args.repeats,
+    )
+
+    output = dict(metadata=_metadata(), results=results)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        output["comparison"] = compare(results, baseline, args.threshold)
+        print("")
+        for c in output["comparison"]:
+            flag = "REGRESSION" if c["regression"] else ""
+            print(f"{c['name'].ljust(32)}{c['ratio']:8.2f}x  {flag}")
+            if c["regression"]:
+                status = 1
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
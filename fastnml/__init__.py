@@ -5,15 +5,17 @@ FastNml -- Read and write Fortran namelists fast.
 
 The `fastnml` code only works with a specific subset of the namelist format. It is not nearly as general or robust as [f90nml](https://github.com/marshallward/f90nml), but it is much faster when reading very large namelists. Also, both codes are tested using multiprocessing to read many namelists in parallel.
 
-This library assumes the namelist is written one value per line.
-This includes all types and array elements.  For example:
+This library assumes the namelist is written one variable per line.
+This includes all types and array elements (or lists of array elements).  For example:
 ```fortran
 &nml
  a = 1,
  c%a(1)%b = 1.0,
  c%a(2)%b = 1.0,
  d(1) = 2,
- d(2) = 3
+ d(2) = 3,
+ e = 1, 2, 3,
+ f(1:4) = 4*0.0
 /
 ```
 If the simple parser fails, it defaults to using `f90nml` to read it.
@@ -21,7 +23,25 @@ If the simple parser fails, it defaults to using `f90nml` to read it.
 ## Public routines
 
  * `fastnml.reader.read_namelist`
+ * `fastnml.reader.read_namelists`
+ * `fastnml.reader.iter_namelist`
+ * `fastnml.reader.NamelistReader`
+ * `fastnml.reader.LazyNamelist`
  * `fastnml.writer.save_namelist`
+ * `fastnml.writer.patch_namelist`
+ * `fastnml.cache.ParseCache`
+ * `fastnml.compact.CompactNamelist`
+ * `fastnml.aio.aread_namelist`
+ * `fastnml.aio.aread_namelists`
+ * `fastnml.aio.aiter_namelist`
+ * `fastnml.aio.asave_namelist`
+ * `fastnml.aio.configure_executor`
+ * `fastnml.stats.ReadStats`
+ * `fastnml.stats.WriteStats`
+ * `fastnml.reader.path_cache_info`
+ * `fastnml.reader.clear_path_cache`
+ * `fastnml.reader.fallback_info`
+ * `fastnml.reader.clear_fallback_info`
 
 ## See also
 
@@ -34,7 +54,29 @@ __version__ = "2.0.3"
 __credits__ = ["Jacob Williams", "Randy Eckman"]
 __license__ = "BSD"
 
-import f90nml
+from .reader import read_namelist, read_namelists, iter_namelist
+from .reader import NamelistReader, LazyNamelist
+from .reader import path_cache_info, clear_path_cache
+from .reader import fallback_info, clear_fallback_info
+from .writer import save_namelist, patch_namelist
+from .cache import ParseCache
+from .compact import CompactNamelist
+from .stats import ReadStats, WriteStats
 
-from .reader import read_namelist
-from .writer import save_namelist
+# the asyncio API is imported on first use (see `__getattr__`)
+_aio_names = (
+    "aread_namelist",
+    "aread_namelists",
+    "aiter_namelist",
+    "asave_namelist",
+    "configure_executor",
+    "shutdown_executor",
+)
+
+
+def __getattr__(name: str):
+    if name in _aio_names:
+        from . import aio
+
+        return getattr(aio, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
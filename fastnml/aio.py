@@ -0,0 +1,367 @@
+"""
+Read and write namelists from asyncio code
+
+The reads and writes run on a shared, bounded executor (threads by
+default, see `configure_executor`), so they don't block the event loop.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import copy
+import functools
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from io import StringIO, TextIOWrapper
+from typing import Any, AsyncIterator, Callable, Iterable, Tuple, Union
+from typing import TYPE_CHECKING
+
+from .reader import NamelistReader, read_namelist, _chunk_spans, _merge_results
+from .reader import _read_namelist_chunk, _try_read_namelist_file, _to_namelist
+from .reader import _split_namelist_text, _map_namelist_file, _stream_chunk_bytes
+from .writer import save_namelist
+from .compact import CompactNamelist
+
+if TYPE_CHECKING:
+    from f90nml import Namelist, Parser
+
+_backends = ("thread", "process")
+
+# the shared executor (created on first use, see `configure_executor`)
+_executor = None
+_executor_config = dict(backend="thread", max_workers=None)
+_executor_lock = threading.Lock()
+# the copy of the user's parser of each executor thread (see `_thread_parser`)
+_threads = threading.local()
+
+
+###############################################################################
+def configure_executor(backend: str = "thread", max_workers: int = None) -> None:
+    """Set the kind and size of the shared executor used by the async functions.
+    The current executor (if any) is shut down once its pending work is done.
+
+    Args:
+        backend (str, optional): "thread" or "process". Threads keep the event loop
+            responsive, processes also parse in parallel. Defaults to "thread".
+        max_workers (int, optional): the number of workers. Defaults to the
+            `concurrent.futures` default for the backend.
+
+    Raises:
+        ValueError: invalid backend.
+    """
+
+    global _executor
+    if backend not in _backends:
+        raise ValueError(f"invalid backend: {backend}")
+    with _executor_lock:
+        executor, _executor = _executor, None
+        _executor_config.update(backend=backend, max_workers=max_workers)
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Shut down the shared executor (a new one is created when it is needed again).
+
+    Args:
+        wait (bool, optional): wait for the pending work to finish. Defaults to True.
+    """
+
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def _shared_executor() -> Executor:
+    """The shared executor (created on first use)."""
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = _executor_config["max_workers"]
+            if _executor_config["backend"] == "process":
+                _executor = ProcessPoolExecutor(max_workers)
+            else:
+                _executor = ThreadPoolExecutor(max_workers, "fastnml")
+        return _executor
+
+
+def _max_workers(executor: Executor) -> int:
+    """The number of workers of an executor (the default concurrency limit)."""
+
+    return getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+
+
+def _submit(executor: Executor, func: Callable, *args) -> asyncio.Future:
+    """Run a function on the executor, as an asyncio future of this loop."""
+
+    return asyncio.wrap_future(executor.submit(func, *args))
+
+
+def _submit_read(
+    executor: Executor, func: Callable, options: dict, *args
+) -> asyncio.Future:
+    """`_submit` for a read function taking the read options first. On threads,
+    a parser given by the user is replaced by a copy of each thread
+    (the `f90nml` parser is not thread-safe).
+    """
+
+    if options.get("parser") is None or isinstance(executor, ProcessPoolExecutor):
+        return _submit(executor, func, options, *args)
+    return _submit(executor, _with_thread_parser, func, options, *args)
+
+
+def _with_thread_parser(func: Callable, options: dict, *args) -> Any:
+    """Call a read function with this thread's copy of the parser."""
+
+    return func(dict(options, parser=_thread_parser(options["parser"])), *args)
+
+
+def _thread_parser(parser: Parser) -> Parser:
+    """This thread's copy of a parser (made on first use, for the last parser used)."""
+
+    cached = getattr(_threads, "parser", None)
+    if cached is None or cached[0] is not parser:
+        cached = _threads.parser = (parser, copy.deepcopy(parser))
+    return cached[1]
+
+
+def _read_namelist_file(
+    options: dict, filename: str
+) -> Union[Namelist, CompactNamelist]:
+    """`read_namelist` with the options first (see `_submit_read`)."""
+
+    return read_namelist(filename, **options)
+
+
+def _cancel(futures: Iterable[asyncio.Future]) -> None:
+    """Cancel the futures (the work that has not started yet is not run)."""
+
+    for future in futures:
+        future.cancel()
+
+
+def _split_file(filename: str, select: tuple) -> list:
+    """The spans of the (selected) namelists in a file (see `_split_namelist_text`)."""
+
+    with _map_namelist_file(filename) as buf:
+        return _split_namelist_text(buf, select)
+
+
+def _reader_options(executor: Executor, kwargs: dict) -> Tuple[NamelistReader, type]:
+    """The read options for the `_read_namelist_*` functions.
+
+    Args:
+        executor (Executor): the executor the reads run on.
+        kwargs (dict): the read options (see `NamelistReader`).
+
+    Returns:
+        Tuple[NamelistReader, type]: a reader without workers (holding the options),
+            and the container type for the simple parser (plain dicts are cheaper
+            to send back from a process).
+    """
+
+    reader = NamelistReader(0, **kwargs)
+    node = reader._node
+    if isinstance(executor, ProcessPoolExecutor) and not reader.compact:
+        node = dict
+    return reader, node
+
+
+###############################################################################
+async def aread_namelist(
+    filename: str, *, executor: Executor = None, **kwargs
+) -> Union[Namelist, CompactNamelist]:
+    """Read a namelist file on the shared executor (see `read_namelist`).
+
+    If the call is cancelled before the read starts, the file is not read.
+    A read that has started runs to completion in the background.
+
+    Args:
+        filename (str): the name of the namelist file to read.
+        executor (Executor, optional): the executor to use. Defaults to the shared one.
+        kwargs: the other arguments of `read_namelist`.
+
+    Returns:
+        Union[Namelist, CompactNamelist]: the resulting namelist object from parsing the file.
+    """
+
+    executor = executor or _shared_executor()
+    return await _submit_read(executor, _read_namelist_file, kwargs, filename)
+
+
+async def aiter_namelist(
+    filename: str, *, executor: Executor = None, limit: int = None, **kwargs
+) -> AsyncIterator[Tuple[str, Union[Namelist, CompactNamelist]]]:
+    """Read a namelist file one namelist at a time, as they are parsed
+    (the async version of `iter_namelist`).
+
+    The file is split in fixed-size chunks of namelists, which are parsed on the
+    executor, at most `limit` at a time, and yielded in order (so the memory used
+    doesn't grow with the file). Closing the iterator (or
+    cancelling the task iterating it) cancels the chunks not started yet.
+
+    Args:
+        filename (str): the name of the namelist file to read.
+        executor (Executor, optional): the executor to use. Defaults to the shared one.
+        limit (int, optional): the maximum number of chunks being parsed at once.
+            Defaults to the number of workers of the executor.
+        kwargs: the read options (as in `NamelistReader`, e.g., `hybrid` or `compact`).
+
+    Yields:
+        Tuple[str, Union[Namelist, CompactNamelist]]: `(group_name, namelist)` for each namelist in the file, in order.
+    """
+
+    executor = executor or _shared_executor()
+    limit = limit or _max_workers(executor)
+    reader, node = _reader_options(executor, kwargs)
+    spans = await asyncio.to_thread(_split_file, filename, reader._options["select"])
+
+    chunks = iter(_chunk_spans(spans, limit, _stream_chunk_bytes))
+    pending = collections.deque()
+    try:
+        while True:
+            while len(pending) < limit:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.append(
+                    _submit_read(
+                        executor,
+                        _read_namelist_chunk,
+                        reader._options,
+                        node,
+                        filename,
+                        chunk,
+                    )
+                )
+            if not pending:
+                return
+            for value in await pending.popleft():
+                for key, nml in value.items():
+                    yield key, _to_namelist(nml)
+    finally:
+        _cancel(pending)
+
+
+async def aread_namelists(
+    filenames: Iterable[str],
+    *,
+    executor: Executor = None,
+    limit: int = None,
+    ordered: bool = True,
+    errors: str = "raise",
+    use_mmap: bool = False,
+    **kwargs,
+) -> AsyncIterator[Tuple[str, Union[Namelist, CompactNamelist, Exception]]]:
+    """Read many namelist files, one file per task (the async version of `read_namelists`).
+
+    At most `limit` files are read at a time. Closing the iterator (or cancelling
+    the task iterating it) cancels the reads not started yet.
+
+    Args:
+        filenames (Iterable[str]): the names of the namelist files to read.
+        executor (Executor, optional): the executor to use. Defaults to the shared one.
+        limit (int, optional): the maximum number of files being read at once.
+            Defaults to the number of workers of the executor.
+        ordered (bool, optional): yield the files in input order.
+            Otherwise, they are yielded as they are completed. Defaults to True.
+        errors (str, optional): what to do if a file can't be read:
+            "raise" the error, "skip" the file, or "return" the error as the result.
+            Defaults to "raise".
+        use_mmap (bool, optional): memory-map the files. Defaults to False.
+        kwargs: the read options (as in `NamelistReader`, e.g., `hybrid` or `compact`).
+
+    Raises:
+        ValueError: invalid `errors` policy.
+
+    Yields:
+        Tuple[str, Union[Namelist, CompactNamelist, Exception]]: `(filename, namelist)` for each file.
+    """
+
+    if errors not in ("raise", "skip", "return"):
+        raise ValueError(f"invalid errors policy: {errors}")
+
+    executor = executor or _shared_executor()
+    limit = limit or _max_workers(executor)
+    reader, node = _reader_options(executor, kwargs)
+    filenames = iter(filenames)
+    pending = collections.deque()
+
+    def submit() -> bool:
+        filename = next(filenames, None)
+        if filename is None:
+            return False
+        pending.append(
+            _submit_read(
+                executor,
+                _try_read_namelist_file,
+                reader._options,
+                node,
+                filename,
+                use_mmap,
+            )
+        )
+        return True
+
+    try:
+        while len(pending) < limit and submit():
+            pass
+        while pending:
+            if ordered:
+                future = pending.popleft()
+                await future
+            else:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                future = next(f for f in pending if f in done)
+                pending.remove(future)
+            submit()
+
+            filename, r, error = future.result()
+            if error is None:
+                yield filename, _merge_results(r, reader._result_type)
+            elif errors == "raise":
+                raise error
+            elif errors == "return":
+                yield filename, error
+    finally:
+        _cancel(pending)
+
+
+###############################################################################
+async def asave_namelist(
+    d: dict, file: Union[str, TextIOWrapper], *, executor: Executor = None, **kwargs
+) -> None:
+    """Write a namelist file on the shared executor (see `save_namelist`).
+
+    If the call is cancelled before the write starts, nothing is written.
+    A write that has started runs to completion in the background.
+
+    Args:
+        d (dict): the namelist data to write.
+        file (Union[str, TextIOWrapper]): the file to write to. If a string, it is the filename.
+        executor (Executor, optional): the executor to use. Defaults to the shared one.
+        kwargs: the other arguments of `save_namelist`.
+    """
+
+    executor = executor or _shared_executor()
+    if isinstance(file, str) or not isinstance(executor, ProcessPoolExecutor):
+        await _submit(executor, functools.partial(save_namelist, d, file, **kwargs))
+    else:
+        # a stream can't be sent to a process: only the formatting is done there
+        text = await _submit(executor, functools.partial(_format_namelist, d, **kwargs))
+        await asyncio.to_thread(file.write, text)
+
+
+def _format_namelist(d: dict, **kwargs) -> str:
+    """`save_namelist` to a string."""
+
+    f = StringIO()
+    save_namelist(d, f, **kwargs)
+    return f.getvalue()
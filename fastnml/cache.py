@@ -0,0 +1,270 @@
+"""
+On-disk cache of parsed namelists
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import namedtuple
+from typing import Union, TYPE_CHECKING
+
+from . import __version__
+from .reader import _to_dict, _to_namelist
+
+if TYPE_CHECKING:
+    from f90nml import Namelist
+
+CacheInfo = namedtuple("CacheInfo", "hits misses invalidations entries size max_size")
+
+# pickle protocol 5 is better for large (e.g., NumPy) arrays
+_protocol = min(5, pickle.HIGHEST_PROTOCOL)
+_block_size = 1 << 20
+# the version of the format of the entries (part of their key, with the fastnml
+# version, so the entries written by other versions are not used)
+_cache_format = 1
+
+
+###############################################################################
+def _default_directory() -> str:
+    """The default cache directory: `$XDG_CACHE_HOME/fastnml` (or `~/.cache/fastnml`)."""
+
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(root, "fastnml")
+
+
+def _hash_file(filename: str) -> str:
+    """Hash the contents of a file.
+
+    Args:
+        filename (str): the name of the file.
+
+    Returns:
+        str: the hex digest.
+    """
+
+    h = hashlib.blake2b(digest_size=20)
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(_block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _options_key(options: dict) -> str:
+    """A string that identifies the read options (including the `f90nml` parser settings).
+
+    Args:
+        options (dict): the keyword arguments for `_read_single_namelist`.
+
+    Returns:
+        str: the key.
+    """
+
+    scalars = (int, float, str, bool, type(None))
+    items = list()
+    for key, value in sorted(options.items()):
+        if key == "parser" and value is not None:
+            value = sorted(
+                (k, v) for k, v in vars(value).items() if isinstance(v, scalars)
+            )
+        items.append((key, value))
+    return repr(items)
+
+
+###############################################################################
+class ParseCache:
+    """A persistent cache of parsed namelist files.
+
+    Entries are keyed by the content hash of the file (and the read options,
+    and the version of fastnml). It can be used from several threads.
+    The size and mtime of each file are also recorded, so an unchanged file
+    is not re-hashed. The least recently used entries are evicted when the
+    cache grows larger than `max_size` bytes.
+
+    Example:
+        ```python
+        cache = ParseCache()
+        nml = read_namelist("big.nml", cache=cache)  # miss: parsed
+        nml = read_namelist("big.nml", cache=cache)  # hit: loaded from the cache
+        print(cache.info())
+        ```
+    """
+
+    def __init__(self, directory: str = None, max_size: int = 1 << 30) -> None:
+        """Create the cache.
+
+        Args:
+            directory (str, optional): the cache directory.
+                Defaults to `$XDG_CACHE_HOME/fastnml` (or `~/.cache/fastnml`).
+            max_size (int, optional): the maximum size of the cache (bytes). Defaults to 1 GiB.
+        """
+
+        self.directory = directory if directory else _default_directory()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()  # for the counters
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _count(self, counter: str) -> None:
+        """Increment one of the counters (`hits`, `misses` or `invalidations`)."""
+
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _path(self, name: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{name}{ext}")
+
+    def _entry(self, filename: str, options: dict) -> str:
+        """Get the cache entry file for a namelist file,
+        hashing the file only if it has changed since it was last seen.
+
+        Args:
+            filename (str): the name of the namelist file.
+            options (dict): the read options.
+
+        Returns:
+            str: the name of the cache entry file.
+        """
+
+        st = os.stat(filename)
+        abspath = os.path.abspath(filename)
+        stamp_file = self._path(
+            hashlib.blake2b(abspath.encode(), digest_size=20).hexdigest(), ".json"
+        )
+
+        stamp = None
+        try:
+            with open(stamp_file, "r") as f:
+                stamp = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        if stamp and stamp["size"] == st.st_size and stamp["mtime"] == st.st_mtime_ns:
+            content_hash = stamp["hash"]
+        else:
+            content_hash = _hash_file(filename)
+            if stamp and stamp["hash"] != content_hash:
+                self._count("invalidations")
+            stamp = dict(size=st.st_size, mtime=st.st_mtime_ns, hash=content_hash)
+            self._write(stamp_file, json.dumps(stamp).encode())
+
+        key = f"{_cache_format}:{__version__}:{content_hash}:{_options_key(options)}"
+        key = hashlib.blake2b(key.encode(), digest_size=20)
+        return self._path(key.hexdigest(), ".pickle")
+
+    def _write(self, filename: str, data: bytes) -> None:
+        """Write a file atomically (through a temporary file unique to this write)."""
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, filename)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def get(self, filename: str, options: dict) -> Union[Namelist, None]:
+        """Get a namelist from the cache.
+
+        Args:
+            filename (str): the name of the namelist file.
+            options (dict): the read options.
+
+        Returns:
+            Union[Namelist, None]: the namelist, or None if it is not in the cache.
+        """
+
+        entry = self._entry(filename, options)
+        try:
+            with open(entry, "rb") as f:
+                d = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self._count("misses")
+            return None
+        os.utime(entry)  # for the LRU eviction
+        self._count("hits")
+        return _to_namelist(d)
+
+    def put(self, filename: str, options: dict, nml: Namelist) -> None:
+        """Add a namelist to the cache.
+
+        Args:
+            filename (str): the name of the namelist file.
+            options (dict): the read options.
+            nml (Namelist): the namelist read from the file.
+        """
+
+        data = pickle.dumps(_to_dict(nml), protocol=_protocol)
+        self._write(self._entry(filename, options), data)
+        self._evict()
+
+    def _entries(self) -> list:
+        """The `(mtime, size, filename)` of the cache entries."""
+
+        entries = list()
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith(".pickle"):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries, until the cache fits in `max_size`."""
+
+        entries = sorted(self._entries())
+        size = sum(e[1] for e in entries)
+        for _, entry_size, entry in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            size -= entry_size
+
+    def clear(self) -> None:
+        """Remove all the entries (and file stamps) from the cache."""
+
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith((".pickle", ".json")):
+                    os.remove(e.path)
+
+    def info(self) -> CacheInfo:
+        """Return the statistics of the cache.
+
+        Returns:
+            CacheInfo: a `(hits, misses, invalidations, entries, size, max_size)` named tuple.
+        """
+
+        entries = self._entries()
+        return CacheInfo(
+            self.hits,
+            self.misses,
+            self.invalidations,
+            len(entries),
+            sum(e[1] for e in entries),
+            self.max_size,
+        )
@@ -0,0 +1,318 @@
+"""
+Compact namelist trees
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping, Sequence
+from typing import Any, Dict, Iterator, List, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from f90nml import Namelist
+
+
+###############################################################################
+class CompactNamelist(MutableMapping):
+    """A compact alternative to `Namelist` for the results of `read_namelist(compact=True)`.
+
+    Each node is a small `__slots__` object holding a plain dict of its
+    (lowercase) variables. Arrays of derived types (e.g., `c%a(i)%b`) are
+    stored as a `CompactArray`, with one array per component rather than
+    one node per element. Read it like a dict, or convert it (or any of its
+    nodes) to a `Namelist` with `to_namelist`. It can be passed to
+    `save_namelist` as it is.
+    """
+
+    __slots__ = ("_items",)
+
+    def __init__(self, items: Mapping = None) -> None:
+        self._items = dict()
+        if items:
+            self.merge(items)
+
+    def __getitem__(self, key: str) -> Any:
+        return self._items[key.lower()]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._items[key.lower()] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self._items[key.lower()]
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and key.lower() in self._items
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __repr__(self) -> str:
+        return f"CompactNamelist({self._items!r})"
+
+    def merge(self, d: Mapping, start_index: dict = None) -> None:
+        """Set all the values of a namelist tree (e.g., read by `f90nml`) in this one.
+        Arrays are merged one element at a time, and missing (`None`) elements are skipped.
+
+        Args:
+            d (Mapping): the namelist tree (`Namelist`, dict or `CompactNamelist`).
+            start_index (dict, optional): the first index of the arrays in `d`
+                (`Namelist.start_index`). Defaults to 1 for each array.
+        """
+
+        for steps, value in _leaves(d, (), start_index):
+            _set_compact(self, steps, value)
+
+    def to_namelist(self) -> Namelist:
+        """Convert to a `Namelist` (the children are converted too).
+
+        Returns:
+            Namelist: the converted namelist.
+        """
+
+        return _to_namelist(self._items.items())
+
+
+###############################################################################
+class CompactArray(Sequence):
+    """An array of derived types, stored as one array per component
+    (struct of arrays). For example, `c%a(1)%b` and `c%a(2)%b` are
+    the two elements of the `b` column of the array `a`.
+
+    Indexing returns a read-only, dict-like view of an element
+    (or None if the element is missing), and slicing returns a `CompactArray`.
+    """
+
+    __slots__ = ("_columns", "_size")
+
+    def __init__(self, size: int = 0) -> None:
+        self._columns = dict()
+        self._size = size
+
+    def __getitem__(self, i: Union[int, slice]) -> Union["_CompactRow", "CompactArray"]:
+        if isinstance(i, slice):
+            array = CompactArray(len(range(*i.indices(self._size))))
+            array._columns = {k: c[i] for k, c in self._columns.items()}
+            return array
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError("CompactArray index out of range")
+        return _CompactRow(self, i) if self._has_row(i) else None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f"CompactArray({self._size}, {self._columns!r})"
+
+    def column(self, name: str) -> Union[list, "CompactArray"]:
+        """One component of all the elements (not a copy).
+
+        Args:
+            name (str): the name of the component.
+
+        Returns:
+            Union[list, CompactArray]: the value of the component for each element
+                (None for the missing ones), or a `CompactArray` if the
+                component is a derived type.
+        """
+
+        return self._columns[name.lower()]
+
+    def to_namelist(self) -> List[Union[Namelist, None]]:
+        """Convert to a list of `Namelist` (None for the missing elements)."""
+
+        return [None if row is None else row.to_namelist() for row in self]
+
+    def _has_row(self, i: int) -> bool:
+        for column in self._columns.values():
+            if isinstance(column, CompactArray):
+                if column._has_row(i):
+                    return True
+            elif column[i] is not None:
+                return True
+        return False
+
+    def _resize(self, size: int) -> None:
+        """Grow the array (and all its columns) to `size` elements."""
+
+        for column in self._columns.values():
+            if isinstance(column, CompactArray):
+                column._resize(size)
+            else:
+                column.extend([None] * (size - self._size))
+        self._size = size
+
+
+class _CompactRow(Mapping):
+    """A read-only view of an element of a `CompactArray`."""
+
+    __slots__ = ("_array", "_index")
+
+    def __init__(self, array: CompactArray, index: int) -> None:
+        self._array = array
+        self._index = index
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._array._columns[key.lower()][self._index]
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        i = self._index
+        for name, column in self._array._columns.items():
+            if column[i] is not None:
+                yield name
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"_CompactRow({dict(self)!r})"
+
+    def to_namelist(self) -> Namelist:
+        """Convert to a `Namelist` (the children are converted too)."""
+
+        return _to_namelist(self.items())
+
+
+# the types that are written as namelist nodes
+_compact_mappings = (CompactNamelist, _CompactRow)
+
+
+###############################################################################
+def _to_namelist(items: Iterator[Tuple[str, Any]]) -> Namelist:
+    """Build a `Namelist` from the items of a compact node."""
+
+    from f90nml import Namelist
+
+    nml = Namelist()
+    for key, value in items:
+        if isinstance(value, (CompactNamelist, _CompactRow, CompactArray)):
+            nml[key] = value.to_namelist()
+        elif isinstance(value, list):
+            nml[key] = value
+        else:
+            # no conversion (e.g., of NumPy arrays)
+            OrderedDict.__setitem__(nml, key, value)
+    return nml
+
+
+def _leaves(
+    d: Mapping, prefix: Tuple[Tuple[str, int], ...], start_index: dict = None
+) -> Iterator[Tuple[Tuple[Tuple[str, int], ...], Any]]:
+    """Walk a namelist tree.
+
+    Args:
+        d (Mapping): the namelist tree.
+        prefix (Tuple[Tuple[str, int], ...]): the compiled path of `d`.
+        start_index (dict, optional): the first index of the arrays in `d`.
+            Defaults to `d.start_index` for a `Namelist`, otherwise 1.
+
+    Yields:
+        Tuple[Tuple[Tuple[str, int], ...], Any]: the compiled path (see `_compile_path`)
+            and value of each scalar and array element.
+    """
+
+    if start_index is None:
+        start_index = getattr(d, "start_index", {})
+    for key, value in d.items():
+        key = key.lower()
+        if isinstance(value, Mapping):
+            yield from _leaves(value, prefix + ((key, None),))
+        elif isinstance(value, (list, CompactArray)):
+            first = (start_index.get(key) or [None])[0] or 1
+            for i, v in enumerate(value, first):
+                if isinstance(v, Mapping):
+                    yield from _leaves(v, prefix + ((key, i),))
+                elif v is not None:
+                    yield prefix + ((key, i),), v
+        else:
+            yield prefix + ((key, None),), value
+
+
+###############################################################################
+def _set_compact(
+    node: CompactNamelist,
+    steps: Tuple[Tuple[str, int], ...],
+    value: Any,
+    sizes: Dict[tuple, int] = None,
+) -> None:
+    """`_set_steps` for a `CompactNamelist`.
+
+    Args:
+        node (CompactNamelist): the namelist to set the value in.
+        steps (Tuple[Tuple[str, int], ...]): the compiled path (see `_compile_path`).
+        value (Any): the value to set.
+        sizes (Dict[tuple, int], optional): not used (the columns are grown as needed).
+    """
+
+    # the container is a node (index is None), or an element of an array
+    container = node
+    index = None
+    for name, i in steps[:-1]:
+        if index is None:
+            items = container._items
+            if i is None:
+                child = items.get(name)
+                if not isinstance(child, CompactNamelist):
+                    child = items[name] = CompactNamelist()
+                container = child
+                continue
+            array = items.get(name)
+            if not isinstance(array, CompactArray):
+                array = items[name] = CompactArray()
+        else:
+            columns = container._columns
+            if i is None:
+                # a derived type in each element: another struct of arrays
+                column = columns.get(name)
+                if not isinstance(column, CompactArray):
+                    column = columns[name] = CompactArray(container._size)
+                container = column
+                continue
+            column = _list_column(container, name)
+            array = column[index]
+            if not isinstance(array, CompactArray):
+                array = column[index] = CompactArray()
+        if array._size < i:
+            array._resize(i)
+        container, index = array, i - 1
+
+    name, i = steps[-1]
+    if index is None:
+        if i is None:
+            container._items[name] = value
+            return
+        x = container._items.get(name)
+        if not isinstance(x, list):
+            x = container._items[name] = list()
+    else:
+        column = _list_column(container, name)
+        if i is None:
+            column[index] = value
+            return
+        x = column[index]
+        if not isinstance(x, list):
+            x = column[index] = list()
+    if len(x) < i:
+        x.extend([None] * (i - len(x)))
+    x[i - 1] = value
+
+
+def _list_column(array: CompactArray, name: str) -> list:
+    """Get (or create) a column of values (not of derived types) of an array."""
+
+    column = array._columns.get(name)
+    if not isinstance(column, list):
+        column = array._columns[name] = [None] * array._size
+    return column
@@ -2,20 +2,118 @@
 Read namelists
 """
 
-from f90nml import Namelist, Parser
-import multiprocessing as mp
+from __future__ import annotations
+
 import re
-from typing import List, Union, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import copy
+import fnmatch
+import mmap
+import functools
+import itertools
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Union, Tuple
+from typing import TYPE_CHECKING
+
+from .stats import ReadStats, _current_stats, _recording, _timer, _timed_list
+from .stats import _worker_id
+from .compact import CompactNamelist, _set_compact
+
+if TYPE_CHECKING:
+    # f90nml (and multiprocessing) are only imported when they are needed,
+    # so a read with the simple parser doesn't pay for them
+    from f90nml import Namelist, Parser
 
 _nml_types = Union[int, float, bool, str]
 _array_rg = re.compile(
     "((?:[a-z][a-z0-9_]*))(\\()(\\d+)(\\))(.*)", re.IGNORECASE | re.DOTALL
 )
+# one line of a namelist: either `path = value` or something else
+_line_rg = re.compile(
+    r"^[ \t]*(?:([^\s=!&/'\"][^=\n]*?)[ \t]*=[ \t]*([^\n]*)|([^\n]*?)\r?$)",
+    re.MULTILINE,
+)
+# one item of a list of values: `[r*]value[,]`
+_item_rg = re.compile(
+    r"""[ \t]*(?:(\d+)\*)?('(?:[^']|'')*'|"(?:[^"]|"")*"|[^\s,'"]+)?[ \t]*(,)?"""
+)
+# an index range at the end of a path: `prefix%name(start:stop[:stride])`
+_range_rg = re.compile(
+    r"^(?:(.*)%)?([a-z][a-z0-9_]*)\([ \t]*(\d*)[ \t]*:[ \t]*(\d*)[ \t]*(?::[ \t]*(\d+)[ \t]*)?\)$",
+    re.IGNORECASE,
+)
+# start (`&`) or end (`/`) of a namelist
+_boundary_rg = re.compile(r"^[ \t]*([&/])", re.MULTILINE)
+_boundary_rgb = re.compile(rb"^[ \t]*([&/])", re.MULTILINE)
+# encoding used to decode the memory-mapped files
+_encoding = "utf-8"
+# batching of the namelists sent to the workers
+_min_chunk_bytes = 1 << 16
+_chunks_per_worker = 4
+# size of the chunks when streaming the namelists (it doesn't grow with the file,
+# so the memory used for the chunks in flight is bounded)
+_stream_chunk_bytes = 1 << 18
 
 ###############################################################################
+# the default f90nml parser of each thread (see `_fallback_parser`)
+_parsers = threading.local()
+
+
+def _namelist_type() -> type:
+    """The `f90nml.Namelist` class (f90nml is imported on first use)."""
+
+    from f90nml import Namelist
+
+    return Namelist
+
+
+def _fallback_parser(parser: Parser = None) -> Parser:
+    """The `f90nml` parser to use when the simple parser fails.
+
+    Args:
+        parser (Parser, optional): the parser given by the user. Defaults to None:
+            a default `Parser` of this thread, created on first use
+            (the parser is not thread-safe).
+
+    Returns:
+        Parser: the parser.
+    """
+
+    if parser is not None:
+        return parser
+    parser = getattr(_parsers, "parser", None)
+    if parser is None:
+        from f90nml import Parser
+
+        parser = _parsers.parser = Parser()
+    return parser
+
+
+def _hybrid_parser(parser: Parser = None) -> Parser:
+    """A copy of the fallback parser (see `_fallback_parser`) for the lines left
+    to f90nml in hybrid mode, with `global_start_index = 1`: the arrays (including
+    those of derived types) start at index 1, so their values can be merged.
+
+    Args:
+        parser (Parser, optional): the parser given by the user. Defaults to None.
+
+    Returns:
+        Parser: the parser.
+    """
+
+    parser = copy.copy(_fallback_parser(parser))
+    parser.global_start_index = 1
+    return parser
+
 
+###############################################################################
 
+@functools.lru_cache(maxsize=4096)
 def _get_array_index(s: str) -> Tuple[int, str]:
     """If the variable name represents an array element (e.g., 'VAR(1)'),
     then return the array index (1-based) and the variable name.
@@ -45,7 +143,150 @@ def _get_array_index(s: str) -> Tuple[int, str]:
 
 
 ###############################################################################
-def _pathSet(dictionary: dict, path: str, value: _nml_types, sep: str = "%") -> None:
+_path_cache_size = 65536
+
+
+@functools.lru_cache(maxsize=_path_cache_size)
+def _compile_path(path: str, sep: str = "%") -> Tuple[Tuple[str, int], ...]:
+    """Parse a namelist path string into a tuple of `(name, index)` steps.
+
+    The result is cached (LRU), so a path shape that repeats many times
+    in a file (or across files) is only split and regex-matched once.
+    Names are converted to lowercase (namelists are case-insensitive).
+
+    Args:
+        path (str): the namelist path string, e.g., "var1%var2(3)%var3"
+        sep (str, optional): the path seperator character. Defaults to "%".
+
+    Returns:
+        Tuple[Tuple[str, int], ...]: one `(name, index)` step per path component.
+            `index` is the 1-based array index, or None if it is not an array element.
+    """
+
+    steps = list()
+    if path:
+        for item in path.lower().split(sep):
+            i, arrayname = _get_array_index(item)
+            if i is not None:
+                steps.append((arrayname, i))
+            else:
+                steps.append((item, None))
+    return tuple(steps)
+
+
+def path_cache_info():
+    """Return the hit/miss statistics of the compiled path cache.
+
+    Returns:
+        functools._CacheInfo: a `(hits, misses, maxsize, currsize)` named tuple.
+    """
+    return _compile_path.cache_info()
+
+
+def clear_path_cache() -> None:
+    """Clear the compiled path cache."""
+    _compile_path.cache_clear()
+
+
+###############################################################################
+def _get_array(dictionary: dict, name: str, i: int, size: int = 0) -> list:
+    """Get (or create) an array in a dictionary, with at least `i` elements.
+    The array is grown in a single operation, padded with `None`.
+
+    Args:
+        dictionary (dict): the dictionary containing the array
+        name (str): the name of the array
+        i (int): the 1-based index of the element that is needed
+        size (int, optional): the size to allocate if the array is created
+            (see `_array_sizes`). Defaults to 0.
+
+    Returns:
+        list: the array.
+    """
+
+    if name in dictionary:
+        x = dictionary[name]
+        lenx = len(x)
+        if lenx < i:
+            # have to add this element
+            x.extend([None] * (i - lenx))
+    else:
+        dictionary[name] = [None] * max(i, size)
+        x = dictionary[name]
+    return x
+
+
+def _array_sizes(paths: Iterable[Tuple[Tuple[str, int], ...]]) -> Dict[tuple, int]:
+    """Pre-scan the paths of a namelist for the size of each array,
+    so each array can be allocated once.
+
+    Args:
+        paths (Iterable[Tuple[Tuple[str, int], ...]]): the compiled paths (see `_compile_path`).
+
+    Returns:
+        Dict[tuple, int]: the size of each array. The key is the compiled path
+            of the array, with a `None` index for the array itself.
+    """
+
+    sizes = dict()
+    for steps in paths:
+        for k, (name, i) in enumerate(steps):
+            if i is not None:
+                key = steps[:k] + ((name, None),)
+                if sizes.get(key, 0) < i:
+                    sizes[key] = i
+    return sizes
+
+
+###############################################################################
+def _walk_steps(
+    dictionary: dict, steps: Tuple[Tuple[str, int], ...], sizes: Dict[tuple, int] = None
+) -> dict:
+    """Walk (and create as needed) the containers along a compiled path.
+    New containers are of the same type as `dictionary`
+    (e.g., `Namelist` or a plain `dict`).
+
+    Args:
+        dictionary (dict): the dictionary to start from
+        steps (Tuple[Tuple[str, int], ...]): the compiled path (see `_compile_path`)
+        sizes (Dict[tuple, int], optional): the sizes of the arrays (see `_array_sizes`).
+
+    Returns:
+        dict: the container at the end of the path.
+    """
+
+    node = type(dictionary)
+    for k, (name, i) in enumerate(steps):
+        if i is not None:
+            # it is an array element:
+            # create this item since it isn't there
+            size = sizes.get(steps[:k] + ((name, None),), 0) if sizes else 0
+            d = _get_array(dictionary, name, i, size)
+
+            # make sure it's a dict:
+            if not isinstance(d[i - 1], dict):
+                d[i - 1] = node()
+            dictionary = d[i - 1]
+        else:
+            # it is just a normal variable:
+            # make sure it's a dict first
+            if not isinstance(dictionary, dict):
+                dictionary = node()
+            if name not in dictionary:
+                dictionary[name] = node()
+            dictionary = dictionary[name]
+
+    return dictionary
+
+
+###############################################################################
+def _pathSet(
+    dictionary: dict,
+    path: str,
+    value: _nml_types,
+    sep: str = "%",
+    sizes: Dict[tuple, int] = None,
+) -> None:
     """Sets a variable in a dictionary, given the namelist path string.
     Assumes the input path uses Fortran-style 1-based indexing of arrays
 
@@ -54,23 +295,33 @@ def _pathSet(dictionary: dict, path: str, value: _nml_types, sep: str = "%") ->
         path (str): the namelist path string, e.g., "var1%var2(3)%var3"
         value (_nml_types): the value to set, can be int, float, bool, or str
         sep (str, optional): the path seperator character. Defaults to "%".
+        sizes (Dict[tuple, int], optional): the sizes of the arrays (see `_array_sizes`).
+    """
+
+    _set_steps(dictionary, _compile_path(path, sep), value, sizes)
+
+
+def _set_steps(
+    dictionary: dict,
+    steps: Tuple[Tuple[str, int], ...],
+    value: _nml_types,
+    sizes: Dict[tuple, int] = None,
+) -> None:
+    """`_pathSet` for a compiled path.
+
+    Args:
+        dictionary (dict): the dictionary to set the value in
+        steps (Tuple[Tuple[str, int], ...]): the compiled path (see `_compile_path`)
+        value (_nml_types): the value to set, can be int, float, bool, or str
+        sizes (Dict[tuple, int], optional): the sizes of the arrays (see `_array_sizes`).
     """
 
-    path = path.split(sep)
-    key = path[-1]
-    dictionary = _pathGet(dictionary, sep.join(path[:-1]), sep=sep)
-    i, arrayname = _get_array_index(key)
+    key, i = steps[-1]
+    dictionary = _walk_steps(dictionary, steps[:-1], sizes)
     if i is not None:
         # it is an array element:
-        if arrayname not in dictionary:
-            dictionary[arrayname] = [None]
-        x = dictionary[arrayname]
-        lenx = len(x)
-        if lenx < i:
-            # have to add this element
-            for j in range(lenx, i):
-                x.append(None)
-        x[i - 1] = value
+        size = sizes.get(steps[:-1] + ((key, None),), 0) if sizes else 0
+        _get_array(dictionary, key, i, size)[i - 1] = value
     else:
         # it is just a normal variable:
         dictionary[key] = value
@@ -92,245 +343,2240 @@ def _pathGet(
         Union[int, float, bool, str, dict, list]: the value at the given path.
     """
 
-    for item in path.split(sep):
-        i, arrayname = _get_array_index(item)
-        if i is not None:
-            # it is an array element:
-            # create this item since it isn't there
-            if arrayname not in dictionary:
-                dictionary[arrayname] = [None]
-            d = dictionary[arrayname]
-            lenx = len(d)
-            if lenx < i:
-                # have to add this element
-                for j in range(lenx, i):
-                    d.append(None)
+    return _walk_steps(dictionary, _compile_path(path, sep))
 
-            # make sure it's a dict:
-            if not isinstance(d[i - 1], dict):
-                d[i - 1] = Namelist({})
-            dictionary = d[i - 1]
-        else:
-            # it is just a normal variable:
-            # make sure it's a dict first
-            if not isinstance(dictionary, dict):
-                dictionary = Namelist({})
-            if item not in dictionary:
-                dictionary[item] = Namelist({})
-            dictionary = dictionary[item]
 
-    return dictionary
+###############################################################################
+def _to_logical(value: str) -> bool:
+    """Convert a namelist logical (e.g., `T`, `.false.`) to a Python bool.
+
+    Args:
+        value (str): the value string.
+
+    Raises:
+        ValueError: not a logical.
+
+    Returns:
+        bool: the value.
+    """
+
+    value_str_bool = value.strip().lower().strip(".")
+    if value_str_bool == "t" or value_str_bool == "true":
+        return True
+    elif value_str_bool == "f" or value_str_bool == "false":
+        return False
+    raise ValueError(f"invalid logical: {value}")
+
+
+def _to_string(value: str) -> str:
+    """Convert a quoted namelist string to a Python string.
+
+    Args:
+        value (str): the value string.
+
+    Raises:
+        ValueError: not a quoted string.
+
+    Returns:
+        str: the value.
+    """
+
+    value_str = value.strip()
+    q = value_str[:1]
+    if (q == "'" or q == '"') and len(value_str) > 1 and value_str[-1] == q:
+        value_str = value_str[1:-1]
+        if q not in value_str or q not in value_str.replace(q + q, ""):
+            # fortran to python convention
+            return value_str.replace(q + q, q)
+    raise ValueError(f"invalid string: {value}")
+
+
+def _to_float(value: str) -> float:
+    """Convert a namelist real (including `1.0d0` style exponents) to a Python float.
+
+    Args:
+        value (str): the value string.
+
+    Returns:
+        float: the value.
+    """
+
+    try:
+        return float(value)
+    except ValueError:
+        return float(value.replace("d", "e").replace("D", "E"))
+
+
+# the conversion for each type that can be used in a schema
+_converters = {int: int, float: _to_float, bool: _to_logical, str: _to_string}
 
 
 ###############################################################################
 def _nml_value_to_python_value(value: str) -> _nml_types:
     """Convert the namelist value to a Python value.
+    The type is chosen based on the first character of the value.
 
     Args:
         value (str): the value from a namelist row as a string.
 
+    Raises:
+        ValueError: invalid (or null) value.
+
     Returns:
         Union[int, float, bool, str]: the value as a Python type.
     """
 
     value_str = value.strip()
-    value_str_bool = value_str.lower().strip(".")
-    if value_str_bool == "t" or value_str_bool == "true":
-        # logical
-        return True
-    elif value_str_bool == "f" or value_str_bool == "false":
-        # logical
-        return False
-    elif value_str[0] == '"' and value_str[-1] == '"':
+    if not value_str:
+        raise ValueError("null value")
+    c = value_str[0]
+    if c == "'" or c == '"':
         # string
-        # fortran to python convention
-        return value_str[1:-1].replace('""', '"')
-    elif value_str[0] == "'" and value_str[-1] == "'":
-        # string
-        # fortran to python convention
-        return value_str[1:-1].replace("''", "'")
-    else:
-        # int or double:
-        try:
-            return int(value_str)
-        except ValueError:
-            return float(value_str)
+        return _to_string(value_str)
+    elif c in "tTfF.":
+        # logical (or a real like `.5`)
+        value_str_bool = value_str.lower().strip(".")
+        if value_str_bool == "t" or value_str_bool == "true":
+            return True
+        elif value_str_bool == "f" or value_str_bool == "false":
+            return False
+
+    # int or double:
+    if "." in value_str or "e" in value_str or "E" in value_str:
+        return _to_float(value_str)
+    try:
+        return int(value_str)
+    except ValueError:
+        return _to_float(value_str)
 
 
 ###############################################################################
-def _read_single_namelist(lines: List[str], parser: Parser, simple: bool) -> Namelist:
-    """Read a namelist
+def _split_values(value: str) -> List[str]:
+    """Split a list of values (e.g., `1, 2, 3`, `1 2 3` or `3*0.0`).
+
+    Args:
+        value (str): the value string.
+
+    Raises:
+        ValueError: invalid (or empty) list.
+
+    Returns:
+        List[str]: the values, with the repeat counts expanded.
+            Null values (e.g., `1, , 3` or `2*`) are None.
+    """
+
+    values = list()
+    pos = 0
+    end = len(value)
+    while pos < end:
+        m = _item_rg.match(value, pos)
+        repeat, item, comma = m.groups()
+        if repeat is None and item is None and comma is None:
+            if m.end() < end:
+                raise ValueError(f"invalid list of values: {value}")
+            break
+        values.extend([item] * (int(repeat) if repeat else 1))
+        pos = m.end()
+    if not values:
+        raise ValueError(f"no values: {value!r}")
+    return values
 
-    * Simple parser. Assumes one array element per line.
-        For example: `val%a(2)%b = value,`
-    * Otherwise (or if the simple parser fails) it defaults
-        to using f90nml to read it.
 
-    Note that comment lines and blank lines have already been removed.
+def _convert_values(
+    path: str, value: str, convert: Callable
+) -> Iterator[Tuple[Tuple[Tuple[str, int], ...], _nml_types]]:
+    """Convert a line with a list of values (or an index range) to one
+    `(steps, value)` record per array element.
 
     Args:
-        lines (List[str]): the lines of the namelist file,
-        parser (Parser): The (`f90nml`) parser to fall back to if the simple parser fails.
-        simple (bool): if the simple parser should be tried first.
+        path (str): the path, e.g., `x` or `c%x(1:10)`.
+        value (str): the list of values (see `_split_values`).
+        convert (Callable): the conversion of each value.
 
     Raises:
-        Exception: invalid line in the namelist.
+        ValueError: invalid path or value, more values than the index range,
+            or a list on an array element (e.g., `x(3) = 1, 2`, left to f90nml).
 
-    Returns:
-        Namelist: the resulant namelist object from parsing the lines.
+    Yields:
+        Tuple[Tuple[Tuple[str, int], ...], _nml_types]: `(steps, value)`
+            for each element (null values are skipped).
     """
 
-    nml = None
-    if simple:
-        try:
+    values = _split_values(value)
+    if ":" in path:
+        prefix, name, indices = _index_range(path, len(values))
+        prefix = _compile_path(prefix) if prefix else ()
+    else:
+        steps = _compile_path(path)
+        if len(values) == 1 or not steps or steps[-1][1] is not None:
+            # a single value, or a list on an array element (e.g., `x(3) = 1, 2`),
+            # which f90nml doesn't spread over the next elements
+            raise ValueError(f"invalid value: {value}")
+        prefix, name = steps[:-1], steps[-1][0]
+        indices = range(1, 1 + len(values))
 
-            namelist_name = lines[0].lstrip("&").strip().lower()
-            nml = Namelist({namelist_name: Namelist({})})
-            for line in lines[1:]:
-                d = line.split("=", 1)
-                if len(d) == 1:
-                    if d[0].strip() == "/":
-                        break  # end of the namelist
-                    else:
-                        # something else - not valid
-                        raise Exception("invalid line")
-                elif len(d) >= 2:
-                    if d[0][0] == "'" or d[0][0] == '"':
-                        # = in a string - not valid
-                        raise Exception("invalid line")
-                    else:
-                        path = d[0].strip()
+    name = name.lower()
+    for i, v in zip(indices, values):
+        if v is not None:
+            yield prefix + ((name, i),), convert(v)
 
-                        if ":" in path:
-                            # can't read multiple entries at once - not valid
-                            raise Exception("invalid line")
-                        else:
-                            # warning: it will still read lines like
-                            # this: `a = 1,2,3` as a single string
 
-                            # convert the string to a Python value:
-                            value = _nml_value_to_python_value(d[1].rstrip(", "))
+def _index_range(path: str, n_values: int) -> Tuple[str, str, range]:
+    """The array elements set by a line with an index range.
 
-                            # add this value to the namelist:
-                            _pathSet(nml[namelist_name], path, value)
+    Args:
+        path (str): the path, e.g., `c%x(1:10)`.
+        n_values (int): the number of values of the line.
 
-        except Exception:
-            nml = None
+    Raises:
+        ValueError: invalid index range, or more values than the range.
 
-    if nml is None:
-        nml = parser.reads("\n".join(lines))  # f90nml 1.1 and above
+    Returns:
+        Tuple[str, str, range]: the path of the array's parent (None at the top),
+            the name of the array and its indices.
+    """
 
-    return nml
+    m = _range_rg.match(path.strip())
+    if not m:
+        raise ValueError(f"invalid index range: {path}")
+    prefix, name, start, stop, stride = m.groups()
+    start = int(start) if start else 1
+    stride = int(stride) if stride else 1
+    stop = int(stop) if stop else start + (n_values - 1) * stride
+    indices = range(start, stop + 1, stride)
+    if n_values > len(indices):
+        raise ValueError(f"too many values for {path}")
+    return prefix, name, indices
 
 
-###############################################################################
-# def split_namelist_str(s: str):
-#     """alternate version of split_namelist_file with a string as an input"""
-#     namelists = []
-#     i = -1
-#     started = False
-#     f = s.split('\n')
-#     for line in f:
-#         line = line.strip()
-#         if (len(line) > 0):
-#             if (line[0] != '!'):
-#                 if (line[0] == '&'):  # start a namelist
-#                     i = i + 1
-#                     namelists.append([])
-#                     started = True
-#                 elif (line[0:1] == '/'):  # end a namelist
-#                     started = False
-#                     namelists[i].append(line)
-#                     continue
-#                 if started:
-#                     namelists[i].append(line)
-#     return namelists
+def _split_elements(path: str, value: str) -> Iterator[Tuple[str, str]]:
+    """Split a line with a list of values (or an index range) into one
+    `(path, raw_value)` per array element, e.g., `x(2) = 1` and `x(3) = 2`
+    for `x(2:3) = 1, 2` (see `_convert_values`).
+
+    Args:
+        path (str): the path, e.g., `x` or `c%x(1:10)`.
+        value (str): the list of values (see `_split_values`).
+
+    Raises:
+        ValueError: invalid path or value, a single value, or a list on an array element.
+
+    Yields:
+        Tuple[str, str]: the path and raw value of each element (null values are skipped).
+    """
+
+    values = _split_values(value)
+    if ":" in path:
+        prefix, name, indices = _index_range(path, len(values))
+    else:
+        steps = _compile_path(path)
+        if len(values) == 1 or not steps or steps[-1][1] is not None:
+            raise ValueError(f"invalid value: {value}")  # see `_convert_values`
+        prefix = path.strip().rpartition("%")[0]
+        name = steps[-1][0]
+        indices = range(1, 1 + len(values))
+
+    prefix = f"{prefix}%" if prefix else ""
+    for i, v in zip(indices, values):
+        if v is not None:
+            yield f"{prefix}{name}({i})", v
+
 
 ###############################################################################
-def _split_namelist_file(filename: str) -> List[list]:
-    """split a namelist file into an array of namelist strings
+@functools.lru_cache(maxsize=32)
+def _compile_patterns(patterns: Tuple[str, ...]) -> re.Pattern:
+    """Compile glob patterns on namelist paths (e.g., `c%a(*)%b`) into one regex.
+    Group `k+1` of a match is the (first) pattern `k` that matched.
 
     Args:
-        filename (str): the name of the namelist file to read.
+        patterns (Tuple[str, ...]): the glob patterns (case-insensitive).
 
     Returns:
-        List[list]: each element is a list of lines of a namelist in the file.
+        re.Pattern: the compiled regex.
     """
 
-    namelists = list()
-    i = -1
-    started = False
-    with open(filename, "r") as f:
-        for line in f:
-            line = line.strip()
-            if len(line) > 0:
-                if line[0] != "!":
-                    if line[0] == "&":  # start a namelist
-                        i = i + 1
-                        namelists.append(list())
-                        started = True
-                    elif line[0:1] == "/":  # end a namelist
-                        started = False
-                        namelists[i].append(line)
-                        continue
-                    if started:
-                        namelists[i].append(line)
-
-    return namelists
+    return re.compile(
+        "|".join(f"({fnmatch.translate(p)})" for p in patterns), re.IGNORECASE
+    )
 
 
-###############################################################################
-def read_namelist(
-    filename: str, *, n_threads: int = 0, parser: Parser = None, simple: bool = True
-) -> Namelist:
-    """Read a namelist quickly.
+_selection = Tuple[Union[Tuple[str, ...], None], Union[Tuple[str, ...], None]]
+
+
+@functools.lru_cache(maxsize=256)
+def _group_selection(
+    group: str, include: Tuple[str, ...] = None, exclude: Tuple[str, ...] = None
+) -> Union[Tuple[Callable, Callable], None]:
+    """Find the paths to read in a namelist.
+
+    The patterns are (lowercase) glob patterns on `group%path`, e.g. `grp%c%a(*)%b`.
+    A pattern also selects everything below it (e.g., `grp%c` selects `grp%c%a(1)%b`,
+    and `grp` the whole namelist).
 
     Args:
-        filename (str): the name of the namelist file to read.
-        n_threads (int, optional): For threaded use, set `n_threads` to the number of threads. Defaults to 0.
-        parser (Parser, optional): The (`f90nml`) parser to fall back to if the simple parser fails. Defaults to None.
-        simple (bool): if the simple parser should be tried first.
+        group (str): the (lowercase) name of the namelist.
+        include (Tuple[str, ...], optional): read only the paths matching these
+            patterns. Defaults to None (all the paths).
+        exclude (Tuple[str, ...], optional): don't read the paths matching these
+            patterns. Defaults to None.
 
     Returns:
-        Namelist: the resulting namelist object from parsing the file.
+        Union[Tuple[Callable, Callable], None]: None if the namelist is not read at all.
+            Otherwise, the `match` functions of the included and excluded paths
+            (None when all the paths are included, or none are excluded).
     """
-    nml = Namelist({})
 
-    def _loop_over_results(r):
-        for key, value in r.items():
-            if key in nml:
-                # array of namelists:
-                if isinstance(nml[key], list):
-                    nml[key].append(value)
+    def paths(patterns: Tuple[str, ...]) -> Tuple[bool, List[str]]:
+        """Whether a pattern is the whole namelist, and the path patterns."""
+        whole = False
+        result = list()
+        for pattern in patterns:
+            group_pattern, _, path = pattern.partition("%")
+            if fnmatch.fnmatchcase(group, group_pattern):
+                if path:
+                    result.extend((path, f"{path}%*", f"{path}(*"))
                 else:
-                    nml[key] = [nml[key], value]
-            else:
-                nml[key] = value
+                    whole = True
+        return whole, result
 
-    if not parser:
-        parser = Parser()
+    include_match = exclude_match = None
+    if include is not None:
+        whole, patterns = paths(include)
+        if not whole and not patterns:
+            return None
+        if not whole:
+            include_match = _compile_patterns(tuple(patterns)).match
+    if exclude is not None:
+        whole, patterns = paths(exclude)
+        if whole:
+            return None
+        if patterns:
+            exclude_match = _compile_patterns(tuple(patterns)).match
+    return include_match, exclude_match
 
-    namelists = _split_namelist_file(filename)
-    results = list()
-    results_append = results.append
 
-    if n_threads:
-        n_threads = max(1, min(mp.cpu_count(), n_threads))
-        pool = mp.Pool(processes=n_threads)
-        pool_apply_async = pool.apply_async
+def _make_selection(
+    include: Iterable[str] = None, exclude: Iterable[str] = None
+) -> Union[_selection, None]:
+    """The `select` read option for the `include` and `exclude` arguments
+    (lowercase tuples of patterns, or None if all the paths are read)."""
 
-        for lines in namelists:
-            results_append(
-                pool_apply_async(_read_single_namelist, (lines, parser, simple))
-            )
-        pool.close()
-        pool.join()
-        for r in results:
-            _loop_over_results(r.get())
-    else:
-        for lines in namelists:
-            results_append(_read_single_namelist(lines, parser, simple))
-        for r in results:
-            _loop_over_results(r)
+    if include is None and exclude is None:
+        return None
+    if isinstance(include, str):
+        include = (include,)
+    if isinstance(exclude, str):
+        exclude = (exclude,)
+    return (
+        None if include is None else tuple(p.lower() for p in include),
+        None if exclude is None else tuple(p.lower() for p in exclude),
+    )
 
-    return nml
+
+def _select_records(
+    records: Iterable[Tuple[str, str, str]], select: _selection
+) -> Iterator[Tuple[str, str, str]]:
+    """Skip the records from `_scan_namelist` with paths that are not selected
+    (before their values are converted). A line with a list of values
+    (or an index range) is split into its array elements (see `_split_elements`)
+    if they are not all selected.
+
+    Args:
+        records (Iterable[Tuple[str, str, str]]): the `(group, path, raw_value)` records.
+        select (_selection): the `(include, exclude)` patterns (see `_group_selection`).
+
+    Yields:
+        Tuple[str, str, str]: the selected records (and the `&` records).
+    """
+
+    include = exclude = None
+    skip = False
+    for record in records:
+        group, path, value = record
+        if path is None:
+            selection = _group_selection(group, *select)
+            skip = selection is None  # only the namelist itself
+            if not skip:
+                include, exclude = selection
+            yield record
+        elif skip or exclude is not None and exclude(path):
+            continue
+        elif (include is None or include(path)) and exclude is None:
+            yield record
+        else:
+            # some elements of a list of values may be selected (or excluded)
+            try:
+                elements = list(_split_elements(path, value))
+            except ValueError:
+                # a single value
+                if include is None or include(path):
+                    yield record
+                continue
+            for element, v in elements:
+                if (include is None or include(element)) and (
+                    exclude is None or not exclude(element)
+                ):
+                    yield group, element, v
+
+
+def _select_tree(d: dict, group: str, select: _selection, path: str = "") -> None:
+    """Remove the values that are not selected from a namelist
+    (for the values read by the `f90nml` parser).
+
+    Args:
+        d (dict): the namelist.
+        group (str): the name of the namelist.
+        select (_selection): the `(include, exclude)` patterns (see `_group_selection`).
+        path (str, optional): the path of `d` in the namelist. Defaults to "".
+    """
+
+    include, exclude = _group_selection(group, *select) or ((lambda p: None), None)
+    if include is None and exclude is None:
+        return
+
+    def keep(p: str) -> bool:
+        return (include is None or include(p)) and not (exclude and exclude(p))
+
+    for key in list(d):
+        value = d[key]
+        p = f"{path}%{key}" if path else key
+        if isinstance(value, dict):
+            _select_tree(value, group, select, p)
+            if not value:
+                del d[key]
+        elif isinstance(value, list):
+            for i, v in enumerate(value):
+                if isinstance(v, dict):
+                    _select_tree(v, group, select, f"{p}({i + 1})")
+                    if not v:
+                        value[i] = None
+                elif v is not None and not keep(f"{p}({i + 1})"):
+                    value[i] = None
+            if all(v is None for v in value):
+                del d[key]
+        elif not keep(p):
+            del d[key]
+
+
+def _convert_records(
+    records: Iterable[Tuple[str, str, str]],
+    schema: Tuple[Tuple[str, type], ...] = None,
+    invalid: List[str] = None,
+) -> Iterator[Tuple[str, Tuple[Tuple[str, int], ...], _nml_types]]:
+    """Compile the paths and convert the values of the records from `_scan_namelist`.
+
+    A line with a list of values (or an index range) is split into one record
+    per array element (see `_convert_values`).
+
+    Args:
+        records (Iterable[Tuple[str, str, str]]): the `(group, path, raw_value)` records.
+        schema (Tuple[Tuple[str, type], ...], optional): `(pattern, type)` pairs. A value
+            with a path matching a glob pattern is converted directly to that type
+            (int, float, bool or str). Other values are converted with
+            `_nml_value_to_python_value`. Defaults to None.
+        invalid (List[str], optional): if given, the records with values that
+            can't be converted are added to it (as `path = value` lines)
+            rather than raising an error. Defaults to None.
+
+    Raises:
+        ValueError: a value can't be converted (to its schema type).
+
+    Yields:
+        Tuple[str, Tuple[Tuple[str, int], ...], _nml_types]: `(group, steps, value)`,
+            where `steps` is the compiled path (see `_compile_path`).
+    """
+
+    if schema:
+        match = _compile_patterns(tuple(p for p, _ in schema)).match
+        converters = [_converters[t] for _, t in schema]
+    for group, path, value in records:
+        if path is None:
+            yield group, None, None
+            continue
+        try:
+            convert = _nml_value_to_python_value
+            if schema:
+                m = match(path)
+                if m:
+                    convert = converters[m.lastindex - 1]
+            if ":" not in path:
+                try:
+                    yield group, _compile_path(path), convert(value)
+                    continue
+                except ValueError:
+                    pass  # a list of values?
+            for steps, v in _convert_values(path, value, convert):
+                yield group, steps, v
+        except ValueError:
+            if invalid is None:
+                raise
+            invalid.append(f"{path} = {value}\n")
+
+
+###############################################################################
+def _scan_namelist(
+    text: str, pos: int = 0, endpos: int = None
+) -> Iterator[Tuple[str, str, str]]:
+    """Single-pass scanner for the simple namelist format.
+
+    Walks the text buffer once (no intermediate list of lines) and yields
+    one `(group, path, raw_value)` record per `path = value` line.
+    The `&group` line yields a `(group, None, None)` record.
+    Blank lines and comment lines are skipped. Scanning stops at the
+    end of the first namelist group (the `/` line).
+
+    Args:
+        text (str): the namelist text buffer.
+        pos (int, optional): index in `text` to start scanning at
+            (must be the start of a line). Defaults to 0.
+        endpos (int, optional): index in `text` to stop scanning at. Defaults to the end of `text`.
+
+    Raises:
+        Exception: invalid line for the simple parser.
+
+    Yields:
+        Tuple[str, str, str]: `(group, path, raw_value)`, where `group` is the
+            lowercase namelist name, `path` is the namelist path string
+            and `raw_value` is the value string with the trailing comma removed.
+    """
+
+    if endpos is None:
+        endpos = len(text)
+    group = None
+    for m in _line_rg.finditer(text, pos, endpos):
+        path, value, other = m.groups()
+        if path is not None:
+            if group is None:
+                # value outside of a namelist - not valid
+                raise Exception(f"invalid line: {m.group(0).strip()}")
+            yield group, path, value.rstrip(", \r")
+        elif not other or other[0] == "!":
+            continue  # blank line or comment
+        elif other[0] == "&":
+            if group is not None:
+                raise Exception(f"invalid line: {m.group(0).strip()}")
+            group = other[1:].strip().lower()
+            if len(group.split()) != 1:
+                raise Exception(f"invalid line: {m.group(0).strip()}")
+            yield group, None, None
+        elif other[0] == "/":
+            break  # end of the namelist
+        else:
+            # something else - not valid
+            raise Exception(f"invalid line: {m.group(0).strip()}")
+
+
+def _scan_namelist_hybrid(
+    text: str, invalid: List[str]
+) -> Iterator[Tuple[str, str, str]]:
+    """`_scan_namelist`, where the value lines that the simple parser can't read
+    are added to `invalid` rather than raising an error.
+
+    A line that is not a `path = value` line (e.g., the rest of a list of values
+    over several lines) is added to `invalid` together with the line it continues.
+
+    Args:
+        text (str): the text of a single namelist group.
+        invalid (List[str]): the list to add the invalid lines to.
+
+    Raises:
+        Exception: invalid `&` line, or a line outside of the namelist.
+
+    Yields:
+        Tuple[str, str, str]: `(group, path, raw_value)` (see `_scan_namelist`).
+    """
+
+    group = None
+    pending = None  # the last record (the next line may continue it)
+    continued = False  # the lines are the continuation of an invalid line
+    for m in _line_rg.finditer(text):
+        path, value, other = m.groups()
+        if path is not None:
+            if group is None:
+                raise Exception(f"invalid line: {m.group(0).strip()}")
+            if pending is not None:
+                yield pending[0]
+            pending = (group, path, value.rstrip(", \r")), m.group(0)
+            continued = False
+        elif not other or other[0] == "!":
+            continue  # blank line or comment
+        elif other[0] == "&":
+            if group is not None:
+                raise Exception(f"invalid line: {m.group(0).strip()}")
+            group = other[1:].strip().lower()
+            if len(group.split()) != 1:
+                raise Exception(f"invalid line: {m.group(0).strip()}")
+            yield group, None, None
+        elif other[0] == "/":
+            break  # end of the namelist
+        elif pending is not None or continued:
+            if pending is not None:
+                invalid.append(pending[1] + "\n")
+                pending = None
+            continued = True
+            invalid.append(m.group(0) + "\n")
+        else:
+            raise Exception(f"invalid line: {m.group(0).strip()}")
+    if pending is not None:
+        yield pending[0]
+
+
+###############################################################################
+FallbackInfo = namedtuple("FallbackInfo", "groups hybrid fallback lines")
+
+# `FallbackInfo` counts for this process
+_fallback_counts = dict.fromkeys(FallbackInfo._fields, 0)
+_fallback_lock = threading.Lock()
+
+
+def _count_fallback(**counts: int) -> None:
+    """Add to the fallback statistics."""
+
+    with _fallback_lock:
+        for key, n in counts.items():
+            _fallback_counts[key] += n
+
+
+def _fallback_snapshot() -> Dict[str, int]:
+    """A copy of the fallback statistics."""
+
+    with _fallback_lock:
+        return dict(_fallback_counts)
+
+
+def fallback_info() -> FallbackInfo:
+    """Return the statistics of the fallback to the `f90nml` parser
+    (for the namelists read by this process, including those read by the
+    workers of a `NamelistReader`, but not by a process executor of the
+    asyncio API).
+
+    Returns:
+        FallbackInfo: a `(groups, hybrid, fallback, lines)` named tuple: the number
+            of namelists read, the number of namelists where some lines were read
+            by `f90nml` (`hybrid` mode), the number of namelists read entirely by
+            `f90nml`, and the number of lines read by `f90nml` in `hybrid` mode.
+    """
+
+    with _fallback_lock:
+        return FallbackInfo(**_fallback_counts)
+
+
+def clear_fallback_info() -> None:
+    """Reset the fallback statistics."""
+
+    with _fallback_lock:
+        _fallback_counts.update(dict.fromkeys(FallbackInfo._fields, 0))
+
+
+def _merge_fallback(d: dict, nml: dict, start_index: dict = None) -> None:
+    """Merge the values read by the `f90nml` parser into a namelist read by the
+    simple parser. New containers are of the same type as `d`.
+
+    Args:
+        d (dict): the namelist to merge into.
+        nml (dict): the values read by `f90nml`.
+        start_index (dict, optional): the first index of the arrays in `nml`
+            (`Namelist.start_index`). Defaults to 1 for each array.
+    """
+
+    if isinstance(d, CompactNamelist):
+        d.merge(nml, start_index)
+        return
+    if start_index is None:
+        start_index = getattr(nml, "start_index", {})
+    node = type(d)
+    for key, value in nml.items():
+        if isinstance(value, dict):
+            if not isinstance(d.get(key), dict):
+                d[key] = node()
+            _merge_fallback(d[key], value)
+        elif isinstance(value, list):
+            first = (start_index.get(key) or [None])[0] or 1
+            if not isinstance(d.get(key), list):
+                _set_item(d, key, list())
+            x = _get_array(d, key, first + len(value) - 1)
+            for i, v in enumerate(value, first - 1):
+                if isinstance(v, dict):
+                    if not isinstance(x[i], dict):
+                        x[i] = node()
+                    _merge_fallback(x[i], v)
+                elif v is not None:
+                    x[i] = v
+        else:
+            d[key] = value
+
+
+###############################################################################
+def _set_item(d: dict, key: str, value: Any) -> None:
+    """Set an item in a dict without any conversion of the value.
+    (`Namelist` converts arrays to lists when they are added).
+
+    Args:
+        d (dict): the dict to set the value in.
+        key (str): the (lowercase) key.
+        value (Any): the value.
+    """
+
+    if isinstance(d, OrderedDict):
+        # a `Namelist` (checked without importing f90nml)
+        OrderedDict.__setitem__(d, key, value)
+    else:
+        d[key] = value
+
+
+def _numeric_array(values: list) -> Any:
+    """Convert a list of numbers (or bools) to a NumPy array.
+
+    Args:
+        values (list): the list. `None` elements are masked.
+
+    Returns:
+        Union[numpy.ndarray, numpy.ma.MaskedArray]: the array, or None
+            if the list is not a numeric array.
+    """
+
+    import numpy as np
+
+    types = set(map(type, values))
+    missing = type(None) in types
+    types.discard(type(None))
+    if not types or not types <= {int, float, bool} or (bool in types and len(types) > 1):
+        return None
+    dtype = bool if bool in types else float if float in types else int
+
+    try:
+        if missing:
+            # missing elements:
+            mask = [v is None for v in values]
+            filled = [dtype() if v is None else v for v in values]
+            return np.ma.MaskedArray(filled, mask=mask, dtype=dtype)
+        else:
+            return np.array(values, dtype=dtype)
+    except OverflowError:
+        # ints too big for numpy
+        return None
+
+
+def _to_numpy_arrays(d: dict) -> None:
+    """Convert (in place) the numeric arrays in a namelist to NumPy arrays.
+
+    Args:
+        d (dict): the namelist.
+    """
+
+    for key, value in d.items():
+        if isinstance(value, (dict, CompactNamelist)):
+            _to_numpy_arrays(value)
+        elif isinstance(value, list):
+            x = _numeric_array(value)
+            if x is not None:
+                _set_item(d, key, x)
+            else:
+                for v in value:
+                    if isinstance(v, dict):
+                        _to_numpy_arrays(v)
+
+
+###############################################################################
+def _read_simple(
+    text: str,
+    node: type = None,
+    presize: bool = False,
+    schema: Tuple[Tuple[str, type], ...] = None,
+    invalid: List[str] = None,
+    select: _selection = None,
+) -> Union[Namelist, dict]:
+    """The simple parser (see `_read_single_namelist`).
+
+    Args:
+        text (str): the text of a single namelist group.
+        node (type, optional): the container type. Defaults to `Namelist`.
+        presize (bool, optional): pre-scan the lines for the size of each array. Defaults to False.
+        schema (Tuple[Tuple[str, type], ...], optional): the types of the values. Defaults to None.
+        invalid (List[str], optional): if given, the lines that can't be read
+            are added to it (hybrid mode), rather than raising an error. Defaults to None.
+        select (_selection, optional): only read the selected paths
+            (see `_group_selection`). Defaults to None.
+
+    Raises:
+        Exception: the simple parser can't read the text.
+
+    Returns:
+        Union[Namelist, dict]: the namelist (without the lines in `invalid`).
+    """
+
+    stats = _current_stats()  # when profiling, each stage is timed separately
+    if node is None:
+        node = _namelist_type()
+    nml = node()
+    if invalid is not None:
+        records = _scan_namelist_hybrid(text, invalid)
+    else:
+        records = _scan_namelist(text)
+    records = _timed_list(stats, "scan", records)
+    if stats is not None:
+        stats.lines += sum(1 for r in records if r[1] is not None)
+    if select is not None:
+        records = _select_records(records, select)
+    records = _convert_records(records, schema, invalid)
+    records = _timed_list(stats, "convert", records)
+    variables = None
+    if invalid is not None:
+        variables = set()
+        records = _record_variables(records, variables)
+    sizes = None
+    if presize:
+        # read all the paths first, to get the array sizes
+        records = list(records)
+        sizes = _array_sizes(p for _, p, _ in records if p is not None)
+    set_steps = _set_compact if node is CompactNamelist else _set_steps
+    with _timer(stats, "build"):
+        for group, steps, value in records:
+            if steps is None:
+                namelist = nml[group] = node()
+            else:
+                # add this value to the namelist:
+                set_steps(namelist, steps, value, sizes)
+    if invalid:
+        _check_fallback_lines(invalid, variables)
+    return nml
+
+
+def _record_variables(
+    records: Iterable[Tuple[str, tuple, Any]], variables: set
+) -> Iterator[Tuple[str, tuple, Any]]:
+    """Pass the records through, adding the variable of each one
+    (its path without the indices, e.g., `("c", "a", "b")` for `c%a(2)%b`)
+    to `variables`."""
+
+    for record in records:
+        steps = record[1]
+        if steps is not None:
+            variables.add(tuple(name for name, _ in steps))
+        yield record
+
+
+def _check_fallback_lines(invalid: List[str], variables: set) -> None:
+    """Check that the lines left to f90nml (hybrid mode) don't set the variables
+    read by the simple parser: their values are merged last, so they would
+    override the later lines.
+
+    Args:
+        invalid (List[str]): the lines left to f90nml.
+        variables (set): the variables read by the simple parser (see `_record_variables`).
+
+    Raises:
+        Exception: a line overlaps the simple ones (the whole namelist must be read by f90nml).
+    """
+
+    prefixes = {v[:k] for v in variables for k in range(1, len(v) + 1)}
+    for line in invalid:
+        path = _line_rg.match(line).group(1)
+        if path is None:
+            continue  # the rest of a list of values
+        variable = tuple(re.sub(r"\([^)]*\)", "", path).strip().lower().split("%"))
+        if variable in prefixes or any(
+            variable[:k] in variables for k in range(1, len(variable))
+        ):
+            raise Exception(f"overlapping hybrid line: {line.strip()}")
+
+
+def _read_single_namelist(
+    text: str,
+    parser: Parser,
+    simple: bool,
+    node: type = None,
+    as_numpy: bool = False,
+    presize: bool = False,
+    schema: Tuple[Tuple[str, type], ...] = None,
+    hybrid: bool = False,
+    select: _selection = None,
+) -> Union[Namelist, dict]:
+    """Read a namelist
+
+    * Simple parser. Assumes one variable per line.
+        For example: `val%a(2)%b = value,`, `x = 1, 2, 3`,
+        `x(1:3) = 3*0.0` (see `_convert_values`).
+    * Otherwise (or if the simple parser fails) it defaults
+        to using f90nml to read it.
+
+    Args:
+        text (str): the text of a single namelist group (from the `&` line to the `/` line).
+        parser (Parser): The (`f90nml`) parser to fall back to if the simple parser fails
+            (None for the default parser, see `_fallback_parser`).
+        simple (bool): if the simple parser should be tried first.
+        node (type, optional): the container type used by the simple parser.
+            Defaults to `Namelist`. The f90nml parser always returns a `Namelist`
+            (converted if `node` is `CompactNamelist`).
+        as_numpy (bool, optional): convert the numeric arrays to NumPy arrays. Defaults to False.
+        presize (bool, optional): pre-scan the lines for the size of each array,
+            so each array is allocated once. Defaults to False.
+        schema (Tuple[Tuple[str, type], ...], optional): the types of the values,
+            as `(pattern, type)` pairs (see `_convert_records`). Defaults to None.
+        hybrid (bool, optional): only send the lines that the simple parser can't
+            read to the f90nml parser (as a smaller namelist), rather than the
+            whole namelist. Defaults to False.
+        select (_selection, optional): only read the paths selected by these
+            `(include, exclude)` patterns (see `_group_selection`). The other lines
+            are skipped before their values are converted. Defaults to None.
+
+    Returns:
+        Union[Namelist, dict]: the resulant namelist object from parsing the text.
+    """
+
+    stats = _current_stats()
+    nml = None
+    invalid = list() if hybrid else None
+    reason = "simple parser not used"
+    if simple:
+        try:
+            nml = _read_simple(text, node, presize, schema, invalid, select)
+            if invalid:
+                (group,) = nml
+                lines = "".join(invalid)
+                with _timer(stats, "fallback"):
+                    fallback = _hybrid_parser(parser).reads(f"&{group}\n{lines}/\n")
+                    if group in fallback:
+                        if select is not None:
+                            _select_tree(fallback[group], group, select)
+                        _merge_fallback(nml[group], fallback[group])
+        except Exception as e:
+            nml = None
+            reason = f"{type(e).__name__}: {e}"
+
+    if nml is None:
+        with _timer(stats, "fallback"):
+            nml = _fallback_parser(parser).reads(text)  # f90nml 1.1 and above
+            if select is not None:
+                for group in list(nml):
+                    if _group_selection(group, *select) is None:
+                        del nml[group]
+                    else:
+                        _select_tree(nml[group], group, select)
+            if node is CompactNamelist:
+                nml = CompactNamelist(nml)
+        _count_fallback(groups=1, fallback=1)
+        if stats is not None:
+            stats.fallbacks.extend((group, reason) for group in nml)
+    elif invalid:
+        _count_fallback(groups=1, hybrid=1, lines=len(invalid))
+    else:
+        _count_fallback(groups=1)
+    if stats is not None:
+        stats.groups += 1
+        stats.fallback_lines += len(invalid) if invalid else 0
+
+    if as_numpy:
+        _to_numpy_arrays(nml)
+
+    return nml
+
+
+###############################################################################
+def _split_namelist_text(
+    text: Union[str, bytes, mmap.mmap], select: _selection = None
+) -> List[Tuple[int, int]]:
+    """Locate the namelist groups in a text buffer.
+
+    Only the `&` and `/` lines are inspected, the rest of the text is not
+    touched. Text outside of the groups is ignored.
+
+    Args:
+        text (Union[str, bytes, mmap.mmap]): the contents of a namelist file.
+            For `bytes` or a memory-mapped file, the raw bytes are scanned
+            and nothing is decoded.
+        select (_selection, optional): only the namelists selected by these
+            `(include, exclude)` patterns (see `_group_selection`). Defaults to None.
+
+    Returns:
+        List[Tuple[int, int]]: the `(start, end)` index of each namelist in `text`.
+    """
+
+    if isinstance(text, str):
+        boundary_rg, amp, newline = _boundary_rg, "&", "\n"
+    else:
+        boundary_rg, amp, newline = _boundary_rgb, b"&", b"\n"
+
+    spans = list()
+    start = None
+    for m in boundary_rg.finditer(text):
+        if m.group(1) == amp:  # start a namelist
+            if start is not None:
+                spans.append((start, m.start()))
+            start = m.start()
+        elif start is not None:  # end a namelist
+            end = text.find(newline, m.end())
+            end = len(text) if end < 0 else end + 1
+            spans.append((start, end))
+            start = None
+    if start is not None:
+        spans.append((start, len(text)))
+
+    if select is not None:
+        spans = [
+            span
+            for span in spans
+            if _group_selection(_group_name(text, span[0]), *select) is not None
+        ]
+
+    return spans
+
+
+###############################################################################
+def _split_namelist_file(filename: str, select: _selection = None) -> List[str]:
+    """split a namelist file into an array of namelist strings
+
+    Args:
+        filename (str): the name of the namelist file to read.
+        select (_selection, optional): only the selected namelists
+            (see `_split_namelist_text`). Defaults to None.
+
+    Returns:
+        List[str]: each element is the text of a namelist in the file.
+    """
+
+    with open(filename, "r") as f:
+        text = f.read()
+
+    return [text[start:end] for start, end in _split_namelist_text(text, select)]
+
+
+###############################################################################
+@contextmanager
+def _map_namelist_file(filename: str) -> Iterator[Union[mmap.mmap, bytes]]:
+    """Memory-map a namelist file (read only).
+
+    Args:
+        filename (str): the name of the namelist file to map.
+
+    Yields:
+        Union[mmap.mmap, bytes]: the mapped file (empty `bytes` for an empty file,
+            which can't be mapped).
+    """
+
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                yield buf
+
+
+###############################################################################
+def _to_namelist(d: dict) -> Namelist:
+    """Convert a tree of plain dicts (as returned by the workers) to a `Namelist`.
+
+    The children are converted first, so `Namelist` doesn't re-sort or
+    re-convert them when they are added to their parent.
+
+    Args:
+        d (dict): the dict to convert.
+
+    Returns:
+        Namelist: the converted namelist (a `CompactNamelist` is not converted).
+    """
+
+    if isinstance(d, CompactNamelist):
+        return d
+    Namelist = _namelist_type()
+    if isinstance(d, Namelist):
+        return d
+
+    nml = Namelist()
+    for key, value in d.items():
+        if isinstance(value, dict):
+            value = _to_namelist(value)
+        elif isinstance(value, list):
+            value = [_to_namelist(v) if isinstance(v, dict) else v for v in value]
+        else:
+            _set_item(nml, key, value)
+            continue
+        nml[key] = value
+    return nml
+
+
+def _to_dict(d: dict) -> dict:
+    """Convert a `Namelist` to a tree of plain dicts (the inverse of `_to_namelist`).
+
+    Args:
+        d (dict): the namelist to convert.
+
+    Returns:
+        dict: the converted dict.
+    """
+
+    result = dict()
+    for key, value in d.items():
+        if isinstance(value, dict):
+            value = _to_dict(value)
+        elif isinstance(value, list):
+            value = [_to_dict(v) if isinstance(v, dict) else v for v in value]
+        result[key] = value
+    return result
+
+
+###############################################################################
+def _chunk_spans(
+    spans: List[Tuple[int, int]], n_threads: int, chunk_bytes: int = None
+) -> List[List[Tuple[int, int]]]:
+    """Batch the namelist spans into chunks to send to the workers.
+
+    Small namelists are grouped together, so each task is about
+    `1/_chunks_per_worker` of each worker's share of the file
+    (but at least `_min_chunk_bytes`).
+
+    Args:
+        spans (List[Tuple[int, int]]): the `(start, end)` byte offsets of each namelist.
+        n_threads (int): the number of workers.
+        chunk_bytes (int, optional): a fixed size of the chunks (e.g., `_stream_chunk_bytes`),
+            rather than a share of the file. Defaults to None.
+
+    Returns:
+        List[List[Tuple[int, int]]]: the chunks of spans.
+    """
+
+    if not spans:
+        return []
+    if chunk_bytes is None:
+        total = spans[-1][1] - spans[0][0]
+        chunk_bytes = max(_min_chunk_bytes, total // (_chunks_per_worker * n_threads))
+
+    chunks = list()
+    chunk = list()
+    size = 0
+    for start, end in spans:
+        chunk.append((start, end))
+        size += end - start
+        if size >= chunk_bytes:
+            chunks.append(chunk)
+            chunk = list()
+            size = 0
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+###############################################################################
+def _merge_namelist(nml: Namelist, r: Union[Namelist, dict]) -> None:
+    """Merge the result of reading a single namelist into `nml`.
+    Repeated namelists are turned into a list.
+
+    Args:
+        nml (Namelist): the namelist to add to.
+        r (Union[Namelist, dict]): the result of `_read_single_namelist`.
+    """
+
+    for key, value in r.items():
+        value = _to_namelist(value)
+        if key in nml:
+            # array of namelists:
+            if isinstance(nml[key], list):
+                nml[key].append(value)
+            else:
+                nml[key] = [nml[key], value]
+        else:
+            nml[key] = value
+
+
+def _merge_results(
+    results: List[Union[Namelist, dict]], node: type = None
+) -> Namelist:
+    """Merge the results of reading the namelists of a file.
+
+    Args:
+        results (List[Union[Namelist, dict]]): the results of `_read_single_namelist`, in order.
+        node (type, optional): the type of the result (`Namelist` or `CompactNamelist`).
+            Defaults to `Namelist`.
+
+    Returns:
+        Namelist: the namelist for the whole file.
+    """
+
+    nml = (node or _namelist_type())()
+    for r in results:
+        _merge_namelist(nml, r)
+    return nml
+
+
+###############################################################################
+def _read_namelist_chunk(
+    options: dict, node: type, filename: str, spans: List[Tuple[int, int]]
+) -> List[Union[Namelist, dict]]:
+    """Read a chunk of namelists from a file.
+
+    Args:
+        options (dict): the keyword arguments for `_read_single_namelist`.
+        node (type): the container type used by the simple parser.
+        filename (str): the name of the namelist file.
+        spans (List[Tuple[int, int]]): the `(start, end)` byte offsets of each namelist.
+
+    Returns:
+        List[Union[Namelist, dict]]: the parsed namelists, in order.
+    """
+
+    results = list()
+    with open(filename, "rb") as f:
+        for start, end in spans:
+            f.seek(start)
+            text = f.read(end - start).decode(_encoding)
+            results.append(_read_single_namelist(text, node=node, **options))
+    return results
+
+
+def _split_group(
+    buf: Union[bytes, mmap.mmap], start: int, end: int, size: int
+) -> List[Tuple[int, int]]:
+    """Split the lines of a namelist (after the `&` line) into parts of about `size` bytes.
+
+    Args:
+        buf (Union[bytes, mmap.mmap]): the contents of the namelist file.
+        start (int): the index of the namelist (the `&` line).
+        end (int): the end of the namelist.
+        size (int): the size of each part.
+
+    Returns:
+        List[Tuple[int, int]]: the `(start, end)` of each part (whole lines).
+    """
+
+    pos = buf.find(b"\n", start, end)
+    pos = end if pos < 0 else pos + 1
+    if len(buf[start:pos].split()) != 1:
+        return []  # not just the name on the `&` line
+    parts = list()
+    while pos < end:
+        stop = buf.find(b"\n", min(pos + size, end) - 1, end)
+        stop = end if stop < 0 else stop + 1
+        parts.append((pos, stop))
+        pos = stop
+    return parts
+
+
+def _read_namelist_part(
+    options: dict, node: type, filename: str, group: str, start: int, end: int
+) -> Union[dict, None]:
+    """Read some of the lines of a namelist with the simple parser
+    (see `_split_group`).
+
+    Args:
+        options (dict): the keyword arguments for `_read_single_namelist`.
+        node (type): the container type used by the simple parser.
+        filename (str): the name of the namelist file.
+        group (str): the name of the namelist.
+        start (int): the byte offset of the first line.
+        end (int): the byte offset of the end of the last line.
+
+    Returns:
+        Union[dict, None]: the (partial) namelist, or None if the simple parser
+            can't read the lines (the whole namelist must be read by f90nml).
+    """
+
+    with open(filename, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode(_encoding)
+    try:
+        nml = _read_simple(
+            f"&{group}\n{text}",
+            node,
+            options["presize"],
+            options["schema"],
+            select=options["select"],
+        )
+    except Exception:
+        return None
+    return nml[group]
+
+
+def _merge_partial(d: dict, part: dict) -> None:
+    """Merge a partial namelist (of the next lines of the namelist) into `d`.
+    Array elements are merged one at a time, and later values replace earlier ones.
+
+    Args:
+        d (dict): the namelist to merge into.
+        part (dict): the partial namelist (see `_read_namelist_part`).
+    """
+
+    if isinstance(d, CompactNamelist):
+        d.merge(part)
+        return
+    for key, value in part.items():
+        current = d.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            _merge_partial(current, value)
+        elif isinstance(value, list) and isinstance(current, list):
+            if len(current) < len(value):
+                current.extend([None] * (len(value) - len(current)))
+            for i, v in enumerate(value):
+                if v is None:
+                    continue
+                if isinstance(v, dict) and isinstance(current[i], dict):
+                    _merge_partial(current[i], v)
+                else:
+                    current[i] = v
+        else:
+            _set_item(d, key, value)
+
+
+def _read_namelist_file(
+    options: dict, node: type, filename: str, use_mmap: bool
+) -> List[Union[Namelist, dict]]:
+    """Read all the namelists in a file.
+
+    Args:
+        options (dict): the keyword arguments for `_read_single_namelist`.
+        node (type): the container type used by the simple parser.
+        filename (str): the name of the namelist file.
+        use_mmap (bool): memory-map the file.
+
+    Returns:
+        List[Union[Namelist, dict]]: the parsed namelists, in order.
+    """
+
+    stats = _current_stats()
+    if use_mmap:
+        with _map_namelist_file(filename) as buf:
+            with _timer(stats, "split"):
+                spans = _split_namelist_text(buf, options["select"])
+            return [
+                _read_single_namelist(
+                    buf[start:end].decode(_encoding), node=node, **options
+                )
+                for start, end in spans
+            ]
+    else:
+        with _timer(stats, "split"):
+            texts = _split_namelist_file(filename, options["select"])
+        return [_read_single_namelist(text, node=node, **options) for text in texts]
+
+
+def _try_read_namelist_file(
+    options: dict, node: type, filename: str, use_mmap: bool
+) -> Tuple[str, List[Union[Namelist, dict]], Exception]:
+    """Read all the namelists in a file, returning any error rather than raising it.
+
+    Args:
+        options (dict): the keyword arguments for `_read_single_namelist`.
+        node (type): the container type used by the simple parser.
+        filename (str): the name of the namelist file.
+        use_mmap (bool): memory-map the file.
+
+    Returns:
+        Tuple[str, List[Union[Namelist, dict]], Exception]: `(filename, results, error)`.
+            Either `results` or `error` is None.
+    """
+
+    try:
+        return filename, _read_namelist_file(options, node, filename, use_mmap), None
+    except Exception as e:
+        return filename, None, e
+
+
+###############################################################################
+# the state of a pool worker (set by `_init_worker`)
+_worker = threading.local()
+
+
+def _init_worker(
+    options: dict,
+    copy_parser: bool = False,
+    profile: bool = False,
+    send_counts: bool = False,
+) -> None:
+    """Pool initializer: sends the parser (and the other read options) to each worker once.
+
+    Args:
+        options (dict): the keyword arguments for `_read_single_namelist`.
+        copy_parser (bool, optional): give this worker its own copy of the parser
+            (the `f90nml` parser is not thread-safe). Defaults to False.
+        profile (bool, optional): collect the `ReadStats` of each task. Defaults to False.
+        send_counts (bool, optional): send the fallback statistics of each task
+            back with its result (for a worker process, see `fallback_info`).
+            Defaults to False.
+    """
+
+    if copy_parser:
+        options = dict(options, parser=copy.deepcopy(options["parser"]))
+    _worker.options = options
+    _worker.profile = profile
+    _worker.send_counts = send_counts
+
+
+def _in_worker(func: Callable, *args) -> Any:
+    """Call one of the `_read_namelist_*` functions with the worker's read options.
+
+    Args:
+        func (Callable): the function to call.
+        args: the rest of the arguments of `func`.
+
+    Returns:
+        Any: the result of `func`. When profiling, or sending the fallback
+            statistics, `(result, stats, counts)`, where `stats` (or `counts`)
+            is None if it is not collected (see `NamelistReader._collect`).
+    """
+
+    if not (_worker.profile or _worker.send_counts):
+        return func(_worker.options, *args)
+
+    stats = counts = None
+    if _worker.send_counts:
+        # a worker process runs one task at a time
+        counts = _fallback_snapshot()
+    if _worker.profile:
+        stats = ReadStats()
+        start = time.perf_counter()
+        with _recording(stats):
+            result = func(_worker.options, *args)
+        stats.add_busy(_worker_id(), time.perf_counter() - start)
+    else:
+        result = func(_worker.options, *args)
+    if counts is not None:
+        counts = {k: n - counts[k] for k, n in _fallback_snapshot().items()}
+    return result, stats, counts
+
+
+def _in_worker_star(args: tuple) -> Any:
+    """`_in_worker` with the arguments as a tuple (for `Pool.imap`)."""
+
+    return _in_worker(*args)
+
+
+###############################################################################
+def _group_name(buf: Union[str, bytes, mmap.mmap], start: int) -> str:
+    """Get the name of the namelist that starts at `start`.
+
+    Args:
+        buf (Union[str, bytes, mmap.mmap]): the contents of a namelist file.
+        start (int): the index of the `&` line.
+
+    Returns:
+        str: the lowercase name of the namelist.
+    """
+
+    newline = "\n" if isinstance(buf, str) else b"\n"
+    end = buf.find(newline, start)
+    header = buf[start : len(buf) if end < 0 else end]
+    if not isinstance(header, str):
+        header = header.decode(_encoding)
+    name = header.strip()[1:].split(None, 1)
+    return name[0].lower() if name else ""
+
+
+class LazyNamelist(Mapping):
+    """A read-only, `Namelist`-like mapping of the namelists in a file,
+    where each namelist is only parsed the first time it is accessed.
+
+    Opening the file only scans it for the `&` and `/` lines.
+    Repeated namelists are returned as a list, as in `read_namelist`.
+    The file should not be changed while it is in use.
+    """
+
+    def __init__(self, filename: str, options: dict) -> None:
+        """Index the namelists in a file.
+
+        Args:
+            filename (str): the name of the namelist file.
+            options (dict): the keyword arguments for `_read_single_namelist`.
+        """
+
+        self.filename = filename
+        self._options = options
+        self._index = OrderedDict()
+        self._cache = dict()
+        with _map_namelist_file(filename) as buf:
+            for start, end in _split_namelist_text(buf, options["select"]):
+                self._index.setdefault(_group_name(buf, start), []).append(
+                    (start, end)
+                )
+
+    def __getitem__(self, key: str) -> Union[Namelist, List[Namelist]]:
+        key = key.lower()
+        if key not in self._cache:
+            results = _read_namelist_chunk(
+                self._options, _namelist_type(), self.filename, self._index[key]
+            )
+            values = [value for r in results for value in r.values()]
+            self._cache[key] = values[0] if len(values) == 1 else values
+        return self._cache[key]
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and key.lower() in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __repr__(self) -> str:
+        return f"LazyNamelist({self.filename!r}, groups={list(self._index)})"
+
+    @property
+    def parsed(self) -> List[str]:
+        """The names of the namelists that have been parsed so far."""
+
+        return [key for key in self._index if key in self._cache]
+
+    def to_namelist(self) -> Namelist:
+        """Parse all the namelists.
+
+        Returns:
+            Namelist: the namelist for the whole file (as `read_namelist`).
+        """
+
+        return _namelist_type()([(key, self[key]) for key in self._index])
+
+
+###############################################################################
+class NamelistReader:
+    """Read namelists with a persistent pool of workers.
+
+    The workers are started once and reused for every read,
+    so the process startup (and `f90nml` import) cost is only paid once.
+
+    Example:
+        ```python
+        with NamelistReader(4) as reader:
+            nml = reader.read("big.nml")
+            nmls = reader.read_many(["case1.nml", "case2.nml"])
+        ```
+    """
+
+    _backends = ("process", "thread", "inline")
+
+    def __init__(
+        self,
+        n_threads: int = 0,
+        *,
+        backend: str = "process",
+        parser: Parser = None,
+        simple: bool = True,
+        use_mmap: bool = False,
+        as_numpy: bool = False,
+        presize: bool = False,
+        schema: Dict[str, type] = None,
+        hybrid: bool = False,
+        cache: "ParseCache" = None,
+        stats: ReadStats = None,
+        split_size: int = 0,
+        include: Iterable[str] = None,
+        exclude: Iterable[str] = None,
+        compact: bool = False,
+    ) -> None:
+        """Create the reader (and start the workers).
+
+        Args:
+            n_threads (int, optional): the number of workers. If 0, the namelists are read inline. Defaults to 0.
+            backend (str, optional): the kind of workers: "process", "thread" or "inline". Defaults to "process".
+            parser (Parser, optional): The (`f90nml`) parser to fall back to if the simple parser fails. Defaults to None (a default parser, created on first use).
+            simple (bool, optional): if the simple parser should be tried first. Defaults to True.
+            use_mmap (bool, optional): memory-map the files read inline or by `read_many`. Defaults to False.
+            as_numpy (bool, optional): return numeric arrays as NumPy arrays (see `read_namelist`). Defaults to False.
+            presize (bool, optional): pre-scan each namelist for the size of its arrays (see `read_namelist`). Defaults to False.
+            schema (Dict[str, type], optional): the types of the values (see `read_namelist`). Defaults to None.
+            hybrid (bool, optional): only send the lines the simple parser can't read to the f90nml parser (see `read_namelist`). Defaults to False.
+            cache (ParseCache, optional): the on-disk cache used by `read`. Defaults to None.
+            stats (ReadStats, optional): collect the statistics of the reads (except `read_lazy`) in this object. Defaults to None.
+            split_size (int, optional): with workers, `read` splits the namelists larger than this (in bytes) into parts of about this size, read by different workers (see `read_namelist`). Defaults to 0 (not split).
+            include (Iterable[str], optional): only read the namelists and paths matching these patterns (see `read_namelist`). Defaults to None (all).
+            exclude (Iterable[str], optional): don't read the namelists and paths matching these patterns (see `read_namelist`). Defaults to None.
+            compact (bool, optional): return `CompactNamelist` trees rather than `Namelist` (see `read_namelist`). Defaults to False.
+
+        Raises:
+            ValueError: invalid backend.
+        """
+
+        if backend not in self._backends:
+            raise ValueError(f"invalid backend: {backend}")
+        if not n_threads:
+            backend = "inline"
+
+        self.parser = parser
+        self.simple = simple
+        self._options = dict(
+            parser=self.parser,
+            simple=simple,
+            as_numpy=as_numpy,
+            presize=presize,
+            schema=tuple(schema.items()) if schema else None,
+            hybrid=hybrid,
+            select=_make_selection(include, exclude),
+        )
+        self.use_mmap = use_mmap
+        self.cache = cache
+        self.backend = backend
+        self.stats = stats
+        self.split_size = split_size
+        self.compact = compact
+        self.n_threads = 0
+        self._pool = None
+        self._snapshots = dict()
+
+        profile = stats is not None
+        if backend == "process":
+            import multiprocessing as mp
+
+            self.n_threads = max(1, min(mp.cpu_count(), n_threads))
+            self._pool = mp.Pool(
+                processes=self.n_threads,
+                initializer=_init_worker,
+                initargs=(self._options, False, profile, True),
+            )
+        elif backend == "thread":
+            from concurrent.futures import ThreadPoolExecutor
+
+            self.n_threads = max(1, n_threads)
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.n_threads,
+                initializer=_init_worker,
+                initargs=(self._options, True, profile),
+            )
+        if profile:
+            stats.n_workers = self.n_threads
+
+    def __enter__(self) -> "NamelistReader":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def close(self) -> None:
+        """Stop the workers, after they finish the pending work."""
+
+        if self.backend == "process" and self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        elif self.backend == "thread" and self._pool is not None:
+            self._pool.shutdown()
+        self._pool = None
+
+    def terminate(self) -> None:
+        """Stop the workers without finishing the pending work."""
+
+        if self.backend == "process" and self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        elif self.backend == "thread" and self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    @property
+    def _node(self) -> type:
+        """The container type built by the simple parser in the workers.
+        Plain dicts are much cheaper to send back from a process."""
+
+        if self.compact:
+            return CompactNamelist
+        return dict if self.backend == "process" else _namelist_type()
+
+    @property
+    def _result_type(self) -> type:
+        """The type of the namelist of a whole file."""
+
+        return CompactNamelist if self.compact else _namelist_type()
+
+    def _submit(self, func: Callable, *args) -> Callable:
+        """Run `func` on a worker.
+
+        Args:
+            func (Callable): one of the `_read_namelist_*` functions.
+            args: the rest of the arguments of `func`.
+
+        Returns:
+            Callable: call this to wait for (and get) the result.
+        """
+
+        if self.backend == "process":
+            get = self._pool.apply_async(_in_worker, (func, *args)).get
+        elif self.backend == "thread":
+            get = self._pool.submit(_in_worker, func, *args).result
+        else:
+            result = self._read_inline(func, *args)
+            return lambda: result
+        return lambda: self._collect(get())
+
+    def _collect(self, result: Any) -> Any:
+        """Unwrap the result of `_in_worker`, adding its stats to `self.stats`
+        (and the fallback statistics of a worker process to `fallback_info`).
+
+        Args:
+            result (Any): the result of `_in_worker`.
+
+        Returns:
+            Any: the result of the function run by the worker.
+        """
+
+        if self.stats is None and self.backend != "process":
+            return result
+        result, stats, counts = result
+        if stats is not None:
+            self.stats.merge(stats)
+        if counts is not None:
+            _count_fallback(**counts)
+        return result
+
+    @contextmanager
+    def _profile(self) -> Iterator[None]:
+        """Add the elapsed time of a read to `self.stats`."""
+
+        if self.stats is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stats.wall_time += time.perf_counter() - start
+
+    def read(self, filename: str) -> Namelist:
+        """Read a namelist file, splitting its namelists across the workers.
+
+        Args:
+            filename (str): the name of the namelist file to read.
+
+        Returns:
+            Namelist: the resulting namelist object from parsing the file.
+        """
+
+        with self._profile():
+            if self.stats is not None:
+                self.stats.files += 1
+            if self.cache is None or self.compact:
+                return self._read(filename)
+
+            nml = self.cache.get(filename, self._options)
+            if nml is None:
+                nml = self._read(filename)
+                self.cache.put(filename, self._options, nml)
+            return nml
+
+    def _read(self, filename: str) -> Namelist:
+        """`read`, without the cache."""
+
+        stats = self.stats
+        if self.backend == "inline":
+            results = self._read_inline(
+                _read_namelist_file, self._node, filename, self.use_mmap
+            )
+            with _timer(stats, "merge"):
+                return _merge_results(results, self._result_type)
+
+        # only the byte offsets of the namelists are sent to the workers
+        with _timer(stats, "split"), _map_namelist_file(filename) as buf:
+            spans = _split_namelist_text(buf, self._options["select"])
+            large = dict()
+            if self.split_size:
+                for start, end in spans:
+                    if end - start > self.split_size:
+                        parts = _split_group(buf, start, end, self.split_size)
+                        large[start, end] = _group_name(buf, start), parts
+
+        tasks = list()
+        for is_large, run in itertools.groupby(spans, lambda span: span in large):
+            if is_large:
+                for span in run:
+                    group, parts = large[span]
+                    parts = [
+                        self._submit(
+                            _read_namelist_part, self._node, filename, group, *part
+                        )
+                        for part in parts
+                    ]
+                    tasks.append(
+                        functools.partial(self._join_parts, filename, span, group, parts)
+                    )
+            else:
+                tasks.extend(
+                    self._submit(_read_namelist_chunk, self._node, filename, chunk)
+                    for chunk in _chunk_spans(list(run), self.n_threads)
+                )
+
+        nml = self._result_type()
+        for r in tasks:
+            with _timer(stats, "wait"):
+                values = r()
+            with _timer(stats, "merge"):
+                for value in values:
+                    _merge_namelist(nml, value)
+        return nml
+
+    def _join_parts(
+        self,
+        filename: str,
+        span: Tuple[int, int],
+        group: str,
+        parts: List[Callable],
+    ) -> List[dict]:
+        """Merge the parts of a large namelist read by the workers.
+        If the simple parser can't read any of them, the whole namelist
+        is read again (by `_read_single_namelist`).
+
+        Args:
+            filename (str): the name of the namelist file.
+            span (Tuple[int, int]): the `(start, end)` of the namelist in the file.
+            group (str): the name of the namelist.
+            parts (List[Callable]): the results of `_read_namelist_part`.
+
+        Returns:
+            List[dict]: the namelist (as `_read_namelist_chunk`).
+        """
+
+        parts = [r() for r in parts]
+        if not parts or any(part is None for part in parts):
+            return self._submit(_read_namelist_chunk, self._node, filename, [span])()
+
+        namelist = parts[0]
+        for part in parts[1:]:
+            _merge_partial(namelist, part)
+        if self._options["as_numpy"]:
+            _to_numpy_arrays(namelist)
+        _count_fallback(groups=1)
+        if self.stats is not None:
+            self.stats.groups += 1
+        return [{group: namelist}]
+
+    def iter_many(
+        self, filenames: Iterable[str], *, ordered: bool = True, errors: str = "raise"
+    ) -> Iterator[Tuple[str, Union[Namelist, Exception]]]:
+        """Read many namelist files, one file per task
+        (each file is split and parsed by a single worker).
+
+        Args:
+            filenames (Iterable[str]): the names of the namelist files to read.
+            ordered (bool, optional): yield the files in input order.
+                Otherwise, they are yielded as they are completed. Defaults to True.
+            errors (str, optional): what to do if a file can't be read:
+                "raise" the error, "skip" the file, or "return" the error as the result.
+                Defaults to "raise".
+
+        Raises:
+            ValueError: invalid `errors` policy.
+
+        Yields:
+            Tuple[str, Union[Namelist, Exception]]: `(filename, namelist)` for each file.
+        """
+
+        if errors not in ("raise", "skip", "return"):
+            raise ValueError(f"invalid errors policy: {errors}")
+
+        args = [
+            (_try_read_namelist_file, self._node, filename, self.use_mmap)
+            for filename in filenames
+        ]
+        with self._profile():
+            if self.backend == "process":
+                imap = self._pool.imap if ordered else self._pool.imap_unordered
+                chunksize = max(1, len(args) // (_chunks_per_worker * self.n_threads))
+                results = map(
+                    self._collect, imap(_in_worker_star, args, chunksize=chunksize)
+                )
+            elif self.backend == "thread":
+                futures = [self._pool.submit(_in_worker, *a) for a in args]
+                if not ordered:
+                    from concurrent.futures import as_completed
+
+                    futures = as_completed(futures)
+                results = (self._collect(future.result()) for future in futures)
+            else:
+                results = (self._read_inline(func, *a) for func, *a in args)
+
+            for filename, r, error in results:
+                if self.stats is not None:
+                    self.stats.files += 1
+                if error is None:
+                    with _timer(self.stats, "merge"):
+                        nml = _merge_results(r, self._result_type)
+                    yield filename, nml
+                elif errors == "raise":
+                    raise error
+                elif errors == "return":
+                    yield filename, error
+
+    def _read_inline(self, func: Callable, *args) -> Any:
+        """Call one of the `_read_namelist_*` functions inline (collecting the stats).
+
+        Args:
+            func (Callable): the function to call.
+            args: the rest of the arguments of `func`.
+
+        Returns:
+            Any: the result of `func`.
+        """
+
+        with _recording(self.stats):
+            return func(self._options, *args)
+
+    def read_many(
+        self, filenames: Iterable[str], *, errors: str = "raise"
+    ) -> List[Union[Namelist, Exception]]:
+        """Read many namelist files, one file per task.
+
+        Args:
+            filenames (Iterable[str]): the names of the namelist files to read.
+            errors (str, optional): what to do if a file can't be read (see `iter_many`).
+                Defaults to "raise".
+
+        Returns:
+            List[Union[Namelist, Exception]]: the namelist of each file, in order.
+        """
+
+        return [nml for _, nml in self.iter_many(filenames, errors=errors)]
+
+    def iter_groups(self, filename: str) -> Iterator[Tuple[str, Namelist]]:
+        """Read a namelist file one namelist at a time.
+
+        Inline, only one namelist is decoded and parsed at a time.
+        With workers, fixed-size chunks of namelists are parsed in parallel
+        (at most one per worker at a time, so the memory used doesn't grow
+        with the file, or when the namelists are consumed slowly) and
+        yielded in order.
+
+        Args:
+            filename (str): the name of the namelist file to read.
+
+        Yields:
+            Tuple[str, Namelist]: `(group_name, namelist)` for each namelist in the file.
+        """
+
+        with self._profile():
+            if self.stats is not None:
+                self.stats.files += 1
+            with _map_namelist_file(filename) as buf:
+                with _timer(self.stats, "split"):
+                    spans = _split_namelist_text(buf, self._options["select"])
+                if self.backend == "inline":
+                    for start, end in spans:
+                        text = buf[start:end].decode(_encoding)
+                        with _recording(self.stats):
+                            nml = _read_single_namelist(
+                                text, node=self._node, **self._options
+                            )
+                        yield from nml.items()
+                    return
+
+            chunks = iter(_chunk_spans(spans, self.n_threads, _stream_chunk_bytes))
+            pending = deque()
+            while True:
+                while len(pending) < self.n_threads:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.append(
+                        self._submit(_read_namelist_chunk, self._node, filename, chunk)
+                    )
+                if not pending:
+                    return
+                for value in pending.popleft()():
+                    for key, nml in value.items():
+                        yield key, _to_namelist(nml)
+
+    def refresh(self, filename: str) -> Namelist:
+        """Read a namelist file, only parsing the namelists that changed since
+        the last `refresh` of the same file.
+
+        Each namelist is hashed, and the namelists with the same hash as in
+        the previous read are reused (they are the same objects as in the
+        previous result, so they should not be modified). The rest are parsed
+        as in `read`. The file should not be changed during the read.
+
+        Args:
+            filename (str): the name of the namelist file to read.
+
+        Returns:
+            Namelist: the resulting namelist object from parsing the file.
+        """
+
+        with self._profile():
+            if self.stats is not None:
+                self.stats.files += 1
+            return self._refresh(filename)
+
+    def _refresh(self, filename: str) -> Namelist:
+        """`refresh`, without the stats of the whole read."""
+
+        stats = self.stats
+        key = os.path.abspath(filename)
+        previous = self._snapshots.get(key, {})
+        digests = list()
+        seen = set()
+        changed = list()
+        with _map_namelist_file(filename) as buf:
+            with _timer(stats, "split"):
+                for start, end in _split_namelist_text(buf, self._options["select"]):
+                    digest = hashlib.blake2b(buf[start:end], digest_size=20).digest()
+                    if digest not in previous and digest not in seen:
+                        changed.append((start, end))
+                    digests.append(digest)
+                    seen.add(digest)
+            if self.backend == "inline":
+                with _recording(stats):
+                    parsed = [
+                        _read_single_namelist(
+                            buf[start:end].decode(_encoding),
+                            node=self._node,
+                            **self._options,
+                        )
+                        for start, end in changed
+                    ]
+
+        if self.backend != "inline":
+            results = [
+                self._submit(_read_namelist_chunk, self._node, filename, chunk)
+                for chunk in _chunk_spans(changed, self.n_threads)
+            ]
+            with _timer(stats, "wait"):
+                parsed = [value for r in results for value in r()]
+
+        parsed = iter(parsed)
+        snapshot = dict()
+        nml = self._result_type()
+        with _timer(stats, "merge"):
+            for digest in digests:
+                if digest in snapshot:
+                    # repeated namelist: don't share the objects
+                    r = copy.deepcopy(snapshot[digest])
+                elif digest in previous:
+                    r = previous[digest]
+                else:
+                    r = {k: _to_namelist(v) for k, v in next(parsed).items()}
+                snapshot.setdefault(digest, r)
+                _merge_namelist(nml, r)
+        self._snapshots[key] = snapshot
+        return nml
+
+    def forget(self, filename: str = None) -> None:
+        """Drop the namelists kept by `refresh`.
+
+        Args:
+            filename (str, optional): the file to forget. Defaults to None (all the files).
+        """
+
+        if filename is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(os.path.abspath(filename), None)
+
+    def read_lazy(self, filename: str) -> LazyNamelist:
+        """Index a namelist file, and parse each namelist the first time it is accessed.
+
+        Args:
+            filename (str): the name of the namelist file to read.
+
+        Returns:
+            LazyNamelist: the namelists in the file.
+        """
+
+        return LazyNamelist(filename, self._options)
+
+
+###############################################################################
+def read_namelist(
+    filename: str,
+    *,
+    n_threads: int = 0,
+    parser: Parser = None,
+    simple: bool = True,
+    use_mmap: bool = False,
+    as_numpy: bool = False,
+    presize: bool = False,
+    schema: Dict[str, type] = None,
+    hybrid: bool = False,
+    lazy: bool = False,
+    cache: "ParseCache" = None,
+    stats: ReadStats = None,
+    split_size: int = 0,
+    include: Iterable[str] = None,
+    exclude: Iterable[str] = None,
+    compact: bool = False,
+) -> Union[Namelist, LazyNamelist, CompactNamelist]:
+    """Read a namelist quickly.
+
+    Args:
+        filename (str): the name of the namelist file to read.
+        n_threads (int, optional): For threaded use, set `n_threads` to the number of threads. Defaults to 0.
+        parser (Parser, optional): The (`f90nml`) parser to fall back to if the simple parser fails. Defaults to None.
+        simple (bool): if the simple parser should be tried first.
+        use_mmap (bool, optional): memory-map the file and only decode the namelists
+            as they are parsed, rather than reading the whole file into a string first.
+            Defaults to False.
+        as_numpy (bool, optional): return the arrays of numbers (int, float or bool) as
+            NumPy arrays rather than lists. Arrays with missing elements are returned as
+            masked arrays (`numpy.ma.MaskedArray`). Requires `numpy`. Defaults to False.
+        presize (bool, optional): pre-scan each namelist for the size of its arrays,
+            so each array is allocated exactly once. Useful for files that write
+            arrays out of order. Defaults to False.
+        schema (Dict[str, type], optional): the types of the values, as a dict of
+            case-insensitive glob patterns on the paths (e.g., `"c%a(*)%b"`) and types
+            (int, float, bool or str). Matching values are converted directly to that
+            type, and a value that can't be converted sends the namelist to the f90nml
+            parser. Defaults to None.
+        hybrid (bool, optional): if some lines of a namelist can't be read by the simple
+            parser (e.g., lists of values), only send those lines to the f90nml parser,
+            rather than the whole namelist. See `fallback_info` for the statistics
+            (including the namelists read by the workers). Defaults to False.
+        lazy (bool, optional): only index the namelists in the file, and parse each
+            one the first time it is accessed (`n_threads` is not used). Defaults to False.
+        cache (ParseCache, optional): an on-disk cache of parsed files
+            (see `fastnml.cache.ParseCache`). Not used for lazy reads. Defaults to None.
+        stats (ReadStats, optional): collect the statistics of the read (timings of each
+            phase, line counts, fallbacks and worker utilization) in this object
+            (see `fastnml.stats.ReadStats`). Not used for lazy reads. Defaults to None.
+        split_size (int, optional): with `n_threads`, the namelists larger than this
+            (in bytes) are split into parts of about this size, which are read in
+            parallel and merged. If the simple parser can't read a part, the whole
+            namelist is read as usual (e.g., by f90nml). Defaults to 0 (not split).
+        include (Iterable[str], optional): only read the namelists and paths matching
+            these case-insensitive glob patterns on `group%path` (e.g., `"run"` for
+            the whole `run` namelist, `"run%c%a(*)%b"` or `"*%dt"`). A pattern also
+            selects everything below its path (e.g., `"run%c"` selects `c%a(1)%b`).
+            The other namelists are skipped when the file is split, and the other
+            lines before their values are converted. Defaults to None (all).
+        exclude (Iterable[str], optional): don't read the namelists and paths matching
+            these patterns (as for `include`). Defaults to None.
+        compact (bool, optional): return a `CompactNamelist` (see `fastnml.compact`)
+            rather than a `Namelist`. Its nodes use `__slots__`, and the arrays of
+            derived types are stored as one array per component, so it uses much
+            less memory, and is faster to send back from the workers, for large
+            nested namelists. Convert it with `to_namelist` when needed.
+            Not used for lazy reads, and `cache` is not used. Defaults to False.
+
+    Returns:
+        Union[Namelist, LazyNamelist, CompactNamelist]: the resulting namelist object from parsing the file.
+
+    See also:
+        `NamelistReader`, to reuse the workers for many reads.
+    """
+
+    with NamelistReader(
+        0 if lazy else n_threads,
+        parser=parser,
+        simple=simple,
+        use_mmap=use_mmap,
+        as_numpy=as_numpy,
+        presize=presize,
+        schema=schema,
+        hybrid=hybrid,
+        cache=cache,
+        stats=stats,
+        split_size=split_size,
+        include=include,
+        exclude=exclude,
+        compact=compact,
+    ) as reader:
+        return reader.read_lazy(filename) if lazy else reader.read(filename)
+
+
+###############################################################################
+def iter_namelist(
+    filename: str,
+    *,
+    n_threads: int = 0,
+    backend: str = "process",
+    parser: Parser = None,
+    simple: bool = True,
+    as_numpy: bool = False,
+    presize: bool = False,
+    schema: Dict[str, type] = None,
+    hybrid: bool = False,
+    stats: ReadStats = None,
+    include: Iterable[str] = None,
+    exclude: Iterable[str] = None,
+    compact: bool = False,
+) -> Iterator[Tuple[str, Namelist]]:
+    """Read a namelist file one namelist at a time, as they are parsed.
+
+    Unlike `read_namelist`, the whole file is never in memory at once,
+    and repeated namelists are yielded separately (not merged into a list).
+
+    Args:
+        filename (str): the name of the namelist file to read.
+        n_threads (int, optional): the number of workers. Defaults to 0.
+        backend (str, optional): the kind of workers: "process", "thread" or "inline". Defaults to "process".
+        parser (Parser, optional): The (`f90nml`) parser to fall back to if the simple parser fails. Defaults to None.
+        simple (bool): if the simple parser should be tried first.
+        as_numpy (bool, optional): return numeric arrays as NumPy arrays (see `read_namelist`). Defaults to False.
+        presize (bool, optional): pre-scan each namelist for the size of its arrays (see `read_namelist`). Defaults to False.
+        schema (Dict[str, type], optional): the types of the values (see `read_namelist`). Defaults to None.
+        hybrid (bool, optional): only send the lines the simple parser can't read to the f90nml parser (see `read_namelist`). Defaults to False.
+        stats (ReadStats, optional): collect the statistics of the read (see `read_namelist`). Defaults to None.
+        include (Iterable[str], optional): only read the namelists and paths matching these patterns (see `read_namelist`). Defaults to None (all).
+        exclude (Iterable[str], optional): don't read the namelists and paths matching these patterns (see `read_namelist`). Defaults to None.
+        compact (bool, optional): return `CompactNamelist` trees rather than `Namelist` (see `read_namelist`). Defaults to False.
+
+    Yields:
+        Tuple[str, Namelist]: `(group_name, namelist)` for each namelist in the file, in order.
+    """
+
+    with NamelistReader(
+        n_threads,
+        backend=backend,
+        parser=parser,
+        simple=simple,
+        as_numpy=as_numpy,
+        presize=presize,
+        schema=schema,
+        hybrid=hybrid,
+        stats=stats,
+        include=include,
+        exclude=exclude,
+        compact=compact,
+    ) as reader:
+        yield from reader.iter_groups(filename)
+
+
+###############################################################################
+def read_namelists(
+    filenames: Iterable[str],
+    *,
+    n_threads: int = 0,
+    backend: str = "process",
+    parser: Parser = None,
+    simple: bool = True,
+    use_mmap: bool = False,
+    hybrid: bool = False,
+    ordered: bool = True,
+    errors: str = "raise",
+    stats: ReadStats = None,
+    include: Iterable[str] = None,
+    exclude: Iterable[str] = None,
+    compact: bool = False,
+) -> Iterator[Tuple[str, Union[Namelist, Exception]]]:
+    """Read many namelist files, parallelized across the files.
+
+    Args:
+        filenames (Iterable[str]): the names of the namelist files to read.
+        n_threads (int, optional): the number of workers. Defaults to 0.
+        backend (str, optional): the kind of workers: "process", "thread" or "inline". Defaults to "process".
+        parser (Parser, optional): The (`f90nml`) parser to fall back to if the simple parser fails. Defaults to None.
+        simple (bool): if the simple parser should be tried first.
+        use_mmap (bool, optional): memory-map the files. Defaults to False.
+        hybrid (bool, optional): only send the lines the simple parser can't read to the f90nml parser (see `read_namelist`). Defaults to False.
+        ordered (bool, optional): yield the files in input order.
+            Otherwise, they are yielded as they are completed. Defaults to True.
+        errors (str, optional): what to do if a file can't be read:
+            "raise" the error, "skip" the file, or "return" the error as the result.
+            Defaults to "raise".
+        stats (ReadStats, optional): collect the statistics of the reads (see `read_namelist`). Defaults to None.
+        include (Iterable[str], optional): only read the namelists and paths matching these patterns (see `read_namelist`). Defaults to None (all).
+        exclude (Iterable[str], optional): don't read the namelists and paths matching these patterns (see `read_namelist`). Defaults to None.
+        compact (bool, optional): return `CompactNamelist` trees rather than `Namelist` (see `read_namelist`). Defaults to False.
+
+    Yields:
+        Tuple[str, Union[Namelist, Exception]]: `(filename, namelist)` for each file.
+    """
+
+    with NamelistReader(
+        n_threads,
+        backend=backend,
+        parser=parser,
+        simple=simple,
+        use_mmap=use_mmap,
+        hybrid=hybrid,
+        stats=stats,
+        include=include,
+        exclude=exclude,
+        compact=compact,
+    ) as reader:
+        yield from reader.iter_many(filenames, ordered=ordered, errors=errors)
@@ -0,0 +1,232 @@
+"""
+Statistics of the reads and writes (for profiling)
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Iterable, Iterator, Tuple, Union
+
+# the phases of a read:
+#   split: locating the namelists in the file (`&` and `/` lines)
+#   scan: splitting the lines into paths and values
+#   convert: converting the values and compiling the paths
+#   build: building the namelist tree
+#   fallback: reading with the f90nml parser
+#   wait: waiting for the results of the workers (including the transfer)
+#   merge: merging the namelists into the result
+_read_phases = ("split", "scan", "convert", "build", "fallback", "wait", "merge")
+
+# the phases of a write:
+#   format: formatting the lines
+#   write: writing to the stream
+_write_phases = ("format", "write")
+
+
+###############################################################################
+class _Stats:
+    """Timings (by phase) and worker utilization, common to reads and writes."""
+
+    _phases: Tuple[str, ...] = ()
+
+    def __init__(self) -> None:
+        self.timings = dict.fromkeys(self._phases, 0.0)
+        self.wall_time = 0.0
+        self.n_workers = 0
+        self.workers = dict()
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        self.timings[phase] += seconds
+
+    def add_busy(self, worker: str, seconds: float) -> None:
+        self.workers[worker] = self.workers.get(worker, 0.0) + seconds
+
+    @property
+    def utilization(self) -> Union[float, None]:
+        """The fraction of the wall time the workers were busy
+        (None if there are no workers)."""
+
+        if not self.n_workers or not self.wall_time:
+            return None
+        return sum(self.workers.values()) / (self.wall_time * self.n_workers)
+
+    def merge(self, other: "_Stats") -> None:
+        """Add the counts of another stats object (e.g., from a worker)."""
+
+        for phase, seconds in other.timings.items():
+            self.add_time(phase, seconds)
+        for worker, seconds in other.workers.items():
+            self.add_busy(worker, seconds)
+
+    def as_dict(self) -> dict:
+        """The statistics as a flat dict (e.g., for a metrics system)."""
+
+        d = {f"{phase}_time": seconds for phase, seconds in self.timings.items()}
+        d["wall_time"] = self.wall_time
+        d["n_workers"] = self.n_workers
+        d["utilization"] = self.utilization
+        return d
+
+
+###############################################################################
+class ReadStats(_Stats):
+    """Statistics of one or more reads.
+
+    Pass an instance as the `stats` argument of `read_namelist` (or
+    `NamelistReader`), and it is filled in as the files are read.
+    Collecting the statistics slows down the reads a little.
+
+    Attributes:
+        timings (Dict[str, float]): the time spent in each phase (seconds,
+            summed over the workers): "split", "scan", "convert", "build",
+            "fallback", "wait" and "merge".
+        wall_time (float): the elapsed time of the reads.
+        n_workers (int): the number of workers.
+        workers (Dict[str, float]): the busy time of each worker.
+        files (int): the number of files read.
+        groups (int): the number of namelists read.
+        lines (int): the number of value lines read by the simple parser.
+        fallback_lines (int): the number of lines read by the f90nml parser in hybrid mode.
+        fallbacks (List[Tuple[str, str]]): the `(group, reason)` of each namelist
+            read entirely by the f90nml parser.
+    """
+
+    _phases = _read_phases
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.files = 0
+        self.groups = 0
+        self.lines = 0
+        self.fallback_lines = 0
+        self.fallbacks = list()
+
+    def merge(self, other: "ReadStats") -> None:
+        super().merge(other)
+        self.groups += other.groups
+        self.lines += other.lines
+        self.fallback_lines += other.fallback_lines
+        self.fallbacks.extend(other.fallbacks)
+
+    def as_dict(self) -> dict:
+        d = super().as_dict()
+        d.update(
+            files=self.files,
+            groups=self.groups,
+            lines=self.lines,
+            fallback_lines=self.fallback_lines,
+            fallback_groups=len(self.fallbacks),
+        )
+        return d
+
+    def __repr__(self) -> str:
+        return (
+            f"ReadStats(files={self.files}, groups={self.groups}, "
+            f"lines={self.lines}, fallbacks={len(self.fallbacks)}, "
+            f"wall_time={self.wall_time:.6f})"
+        )
+
+
+###############################################################################
+class WriteStats(_Stats):
+    """Statistics of one or more writes.
+
+    Pass an instance as the `stats` argument of `save_namelist`,
+    and it is filled in as the namelists are written.
+
+    Attributes:
+        timings (Dict[str, float]): the time spent in each phase (seconds,
+            summed over the workers): "format" and "write".
+        wall_time (float): the elapsed time of the writes.
+        n_workers (int): the number of workers.
+        workers (Dict[str, float]): the busy time of each worker.
+        groups (int): the number of namelists written.
+        lines (int): the number of lines written.
+        chars (int): the number of characters written.
+    """
+
+    _phases = _write_phases
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.groups = 0
+        self.lines = 0
+        self.chars = 0
+
+    def as_dict(self) -> dict:
+        d = super().as_dict()
+        d.update(groups=self.groups, lines=self.lines, chars=self.chars)
+        return d
+
+    def __repr__(self) -> str:
+        return (
+            f"WriteStats(groups={self.groups}, lines={self.lines}, "
+            f"chars={self.chars}, wall_time={self.wall_time:.6f})"
+        )
+
+
+###############################################################################
+# the stats being collected by this thread
+_current = threading.local()
+
+
+def _current_stats() -> Union[_Stats, None]:
+    """The stats being collected by this thread (see `_recording`)."""
+
+    return getattr(_current, "stats", None)
+
+
+@contextmanager
+def _recording(stats: Union[_Stats, None]) -> Iterator[None]:
+    """Collect the stats of the reads in this thread into `stats`."""
+
+    previous = _current_stats()
+    _current.stats = stats
+    try:
+        yield
+    finally:
+        _current.stats = previous
+
+
+def _timer(stats: Union[_Stats, None], phase: str):
+    """A context manager adding the time spent in it to a phase
+    (does nothing if `stats` is None)."""
+
+    if stats is None:
+        return nullcontext()
+    return _timing(stats, phase)
+
+
+@contextmanager
+def _timing(stats: _Stats, phase: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_time(phase, time.perf_counter() - start)
+
+
+def _timed_list(stats: Union[_Stats, None], phase: str, items: Iterable) -> Iterable:
+    """Run a pipeline stage to completion (a list), adding its time to a phase.
+    If `stats` is None, the stage is returned as it is (not run).
+
+    Args:
+        stats (Union[_Stats, None]): the stats.
+        phase (str): the phase.
+        items (Iterable): the pipeline stage (e.g., a generator).
+
+    Returns:
+        Iterable: the items.
+    """
+
+    if stats is None:
+        return items
+    with _timing(stats, phase):
+        return list(items)
+
+
+def _worker_id() -> str:
+    """An identifier of this worker (process and thread)."""
+
+    return f"{os.getpid()}:{threading.get_ident()}"
@@ -2,85 +2,604 @@
 Write namelists
 """
 
-from typing import Union, Any
-from io import TextIOWrapper
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Union, Any, Dict, List, Tuple, Callable, Iterator
+from io import TextIOWrapper, StringIO
+
+from .reader import _compile_path, _line_rg, _encoding
+from .reader import _split_namelist_text, _map_namelist_file, _group_name
+from .stats import WriteStats, _timer, _worker_id
+from .compact import CompactArray, _compact_mappings
+
+# number of lines collected before each write to the stream
+_lines_per_write = 8192
+
+# number of array elements formatted by each parallel task
+_elements_per_task = 65536
+
+# the `&group` line of a namelist to patch (nothing but a comment after the name)
+_patch_header_rg = re.compile(r"[ \t]*&[ \t]*\w+[ \t]*(?:!.*)?$")
+# the value of a line, up to its comment (if any)
+_patch_value_rg = re.compile(
+    r"""(?:'(?:[^']|'')*'|"(?:[^"]|"")*"|['"][^\n]*|[^'"!\n])*"""
+)
+
 
 ###############################################################################
-def _traverse_value(f: TextIOWrapper, path: str, sep: str, path2: str, d: Any):
+class _LineBuffer:
+    """Collects the output lines, and writes them to the stream
+    with one large write per chunk of lines."""
 
-    if path.strip() != "":
-        path2 = f"{path}{sep}{path2}"
-    _traverse_dict(f, d, path2)
+    def __init__(
+        self, f: TextIOWrapper, size: int = _lines_per_write, stats: WriteStats = None
+    ) -> None:
+        self.f = f
+        self.size = size
+        self.stats = stats
+        self.lines = list()
+
+    def append(self, line: str) -> None:
+        self.lines.append(line)
+        if len(self.lines) >= self.size:
+            self.flush()
+
+    def extend(self, lines: List[str]) -> None:
+        self.lines.extend(lines)
+        if len(self.lines) >= self.size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.lines:
+            text = "".join(self.lines)
+            if self.stats is not None:
+                self.stats.lines += len(self.lines)
+                self.stats.chars += len(text)
+            with _timer(self.stats, "write"):
+                self.f.write(text)
+            self.lines.clear()
 
 
 ###############################################################################
-def _traverse_dict(f: TextIOWrapper, d: Any, path: str = "", sep: str = "%"):
+def _format_value(d: Any) -> Union[str, None]:
+    """Format a scalar value for a namelist.
+
+    Args:
+        d (Any): the value.
+
+    Returns:
+        Union[str, None]: the formatted value, or None if it is not written.
+    """
+
+    if d is None:
+        return None
+    elif isinstance(d, str):
+        s = d.replace("'", "''")
+        return f"'{s}'"
+    elif isinstance(d, bool):
+        return ["F", "T"][int(d)]
+    elif isinstance(d, int):
+        return f"{d}"
+    elif isinstance(d, float):
+        return f"{d:.17E}"
+    return None
+
+
+###############################################################################
+def _format_array(prefix: str, v: list, first: int = 1) -> Union[List[str], None]:
+    """Format all the elements of a homogeneous array at once.
+
+    Args:
+        prefix (str): the start of each line, up to the index (e.g., `" c%a("`).
+        v (list): the array elements.
+        first (int, optional): the index of the first element. Defaults to 1.
+
+    Returns:
+        Union[List[str], None]: the lines, or None if the array is not
+            all str, bool, int or float (with `None` for missing elements).
+    """
+
+    types = set(map(type, v))
+    types.discard(type(None))
+    if len(types) != 1:
+        return None
+    t = types.pop()
+    elements = [(i, x) for i, x in enumerate(v, first) if x is not None]
+    if t is float or t is int:
+        # printf-style formatting is faster for large arrays
+        fmt = "%.17E" if t is float else "%d"
+        template = prefix.replace("%", "%%") + "%d) = " + fmt + ",\n"
+        return [template % e for e in elements]
+    elif t is bool:
+        tf = ["F", "T"]
+        return [f"{prefix}{i}) = {tf[x]},\n" for i, x in elements]
+    elif t is str:
+        return [f"""{prefix}{i}) = '{x.replace("'", "''")}',\n""" for i, x in elements]
+    return None
+
+
+###############################################################################
+def _traverse_array(buf: _LineBuffer, path: str, v: list, sep: str = "%"):
+    """
+    print the elements of an array in namelist style
+    """
+
+    prefix = f" {path.lower()}("
+    for start in range(0, len(v), _lines_per_write):
+        chunk = v[start : start + _lines_per_write]
+        lines = _format_array(prefix, chunk, start + 1)
+        if lines is None:
+            for index, element in enumerate(chunk, start + 1):
+                _traverse_dict(buf, element, f"{path}({index})", sep)
+        else:
+            buf.extend(lines)
+
+
+###############################################################################
+def _traverse_dict(buf: _LineBuffer, d: Any, path: str = "", sep: str = "%"):
     """
     traverse a dict and print the paths to each variable in namelist style
     """
 
-    if isinstance(d, dict):
+    if isinstance(d, dict) or isinstance(d, _compact_mappings):
         for k, v in d.items():
-            if isinstance(v, list):
-                index = 0
-                for element in v:
-                    index += 1
-                    _traverse_value(f, path, sep, f"{k}({index})", element)
+            if hasattr(v, "tolist"):
+                # NumPy array (masked elements become None)
+                v = v.tolist()
+            path2 = f"{path}{sep}{k}" if path.strip() != "" else k
+            if isinstance(v, (list, CompactArray)):
+                _traverse_array(buf, path2, v, sep)
             else:
-                _traverse_value(f, path, sep, k, v)
+                _traverse_dict(buf, v, path2, sep)
     elif isinstance(d, list):
         for element in d:
-            _traverse_dict(f, element, path)
+            _traverse_dict(buf, element, path, sep)
     else:
-        path = path.lower()
-        if d is None:
-            pass
-        elif isinstance(d, str):
-            s = d.replace("'", "''")
-            f.write(f" {path} = '{s}',\n")
-        elif isinstance(d, bool):
-            f.write(f" {path} = {['F', 'T'][int(d)]},\n")
-        elif isinstance(d, int):
-            f.write(f" {path} = {d},\n")
-        elif isinstance(d, float):
-            f.write(f" {path} = {d:.17E},\n")
+        s = _format_value(d)
+        if s is not None:
+            buf.append(f" {path.lower()} = {s},\n")
 
 
 ###############################################################################
-def _print_single_namelist(f: TextIOWrapper, namelist_name: str, d: dict):
+def _print_single_namelist(buf: _LineBuffer, namelist_name: str, d: dict):
 
-    f.write(f"&{namelist_name.lower()}\n")
-    _traverse_dict(f, d)
-    f.write("/\n")
-    f.write("\n")
+    buf.append(f"&{namelist_name.lower()}\n")
+    _traverse_dict(buf, d)
+    buf.append("/\n")
+    buf.append("\n")
 
 
 ###############################################################################
-def _write_namelist_to_stream(d: dict, file: TextIOWrapper):
+def _write_namelist_to_stream(
+    d: dict, file: TextIOWrapper, stats: WriteStats = None
+):
     """Called by `save_namelist`"""
 
+    buf = _LineBuffer(file, stats=stats)
     for k, v in d.items():
         if isinstance(v, list):
             for element in v:
-                _print_single_namelist(file, k, element)
-        elif isinstance(v, dict):
-            _print_single_namelist(file, k, v)
+                _print_single_namelist(buf, k, element)
+        elif isinstance(v, dict) or isinstance(v, _compact_mappings):
+            _print_single_namelist(buf, k, v)
+    buf.flush()
+
+
+###############################################################################
+def _format_group_items(name: Union[str, None], items: dict) -> str:
+    """Format some of the variables of a namelist (in a worker).
+
+    Args:
+        name (Union[str, None]): the namelist name, if the header starts here.
+        items (dict): the variables to format.
+
+    Returns:
+        str: the formatted lines.
+    """
+
+    f = StringIO()
+    buf = _LineBuffer(f)
+    if name is not None:
+        buf.append(f"&{name.lower()}\n")
+    _traverse_dict(buf, items)
+    buf.flush()
+    return f.getvalue()
+
+
+###############################################################################
+def _format_array_chunk(path: str, v: list, first: int) -> str:
+    """Format a slice of a large array (in a worker).
+
+    Args:
+        path (str): the path of the array.
+        v (list): the elements of the slice.
+        first (int): the index of the first element of the slice.
+
+    Returns:
+        str: the formatted lines.
+    """
+
+    f = StringIO()
+    buf = _LineBuffer(f)
+    lines = _format_array(f" {path.lower()}(", v, first)
+    if lines is None:
+        for index, element in enumerate(v, first):
+            _traverse_dict(buf, element, f"{path}({index})")
+    else:
+        buf.extend(lines)
+    buf.flush()
+    return f.getvalue()
+
+
+###############################################################################
+def _plan_single_namelist(name: str, d: dict) -> Iterator[Tuple[Callable, tuple]]:
+    """Split a namelist into formatting tasks.
+
+    Consecutive variables are formatted together, and each large array
+    is split into slices of `_elements_per_task` elements.
+
+    Args:
+        name (str): the namelist name.
+        d (dict): the namelist.
+
+    Yields:
+        Tuple[Callable, tuple]: the function and its arguments, in output order.
+    """
+
+    header = name
+    items = dict()
+    for k, v in d.items():
+        if hasattr(v, "tolist"):
+            v = v.tolist()
+        if isinstance(v, (list, CompactArray)) and len(v) > _elements_per_task:
+            if header is not None or items:
+                yield _format_group_items, (header, items)
+                header, items = None, dict()
+            for start in range(0, len(v), _elements_per_task):
+                chunk = v[start : start + _elements_per_task]
+                yield _format_array_chunk, (k, chunk, start + 1)
+        else:
+            items[k] = v
+    yield _format_group_items, (header, items)
+
+
+###############################################################################
+def _plan_namelist(d: dict) -> Iterator[Tuple[Callable, tuple]]:
+    """Split the namelists into formatting tasks, in output order."""
+
+    for k, v in d.items():
+        if isinstance(v, list):
+            for element in v:
+                yield from _plan_single_namelist(k, element)
+                yield str, ("/\n\n",)
+        elif isinstance(v, dict) or isinstance(v, _compact_mappings):
+            yield from _plan_single_namelist(k, v)
+            yield str, ("/\n\n",)
+
+
+###############################################################################
+def _call_star(task: Tuple[Callable, tuple]) -> str:
+    """Run a formatting task (for `Pool.imap`)."""
+
+    func, args = task
+    return func(*args)
+
+
+def _call_star_timed(task: Tuple[Callable, tuple]) -> Tuple[str, str, float]:
+    """`_call_star`, also returning the worker and the time it took."""
+
+    start = time.perf_counter()
+    text = _call_star(task)
+    return text, _worker_id(), time.perf_counter() - start
 
 
 ###############################################################################
-def save_namelist(d: dict, file: Union[str, TextIOWrapper]) -> None:
+def _write_namelist_parallel(
+    d: dict, file: TextIOWrapper, n_threads: int, stats: WriteStats = None
+):
+    """Format the namelists in a process pool, and write the pieces in order."""
+
+    import multiprocessing as mp
+
+    with mp.Pool(n_threads) as pool:
+        if stats is None:
+            for text in pool.imap(_call_star, _plan_namelist(d)):
+                file.write(text)
+            return
+
+        stats.n_workers = n_threads
+        for text, worker, seconds in pool.imap(_call_star_timed, _plan_namelist(d)):
+            stats.add_busy(worker, seconds)
+            stats.add_time("format", seconds)
+            stats.lines += text.count("\n")
+            stats.chars += len(text)
+            with _timer(stats, "write"):
+                file.write(text)
+
+
+###############################################################################
+def save_namelist(
+    d: dict,
+    file: Union[str, TextIOWrapper],
+    *,
+    n_threads: int = 0,
+    stats: WriteStats = None,
+) -> None:
     """Print a dict as a namelist file.
     Assumes an `f90nml` namelist style structure
-    (a dict of dicts, some of which can be lists).
+    (a dict of dicts, some of which can be lists), or a `CompactNamelist`.
 
     This uses the "simple" format, with one variable per line.
 
     Args:
         d (dict): the namelist data to write
         file (Union[str, TextIOWrapper]): the file to write to. If a string, it is the filename.
+        n_threads (int, optional): the number of worker processes formatting the
+            namelists (and the large arrays) concurrently. The output is the same
+            as a serial write. If 0, the namelists are written inline. Defaults to 0.
+        stats (WriteStats, optional): collect the statistics of the write (timings,
+            line counts and worker utilization) in this object
+            (see `fastnml.stats.WriteStats`). Defaults to None.
     """
     if isinstance(file, str):
-        with open(file, "w") as file:
-            _write_namelist_to_stream(d, file)
+        with open(file, "w") as f:
+            save_namelist(d, f, n_threads=n_threads, stats=stats)
+        return
+
+    start = time.perf_counter()
+    write_time = stats.timings["write"] if stats is not None else 0.0
+    if n_threads > 0:
+        _write_namelist_parallel(d, file, n_threads, stats)
     else:
-        _write_namelist_to_stream(d, file)
+        _write_namelist_to_stream(d, file, stats)
+    if stats is not None:
+        seconds = time.perf_counter() - start
+        stats.wall_time += seconds
+        stats.groups += sum(
+            len(v) if isinstance(v, list) else 1
+            for v in d.values()
+            if isinstance(v, (list, dict)) or isinstance(v, _compact_mappings)
+        )
+        if n_threads == 0:
+            write_time = stats.timings["write"] - write_time
+            stats.add_time("format", seconds - write_time)
+
+
+###############################################################################
+def _flatten_change(
+    path: str, value: Any, sep: str = "%"
+) -> Iterator[Tuple[str, str]]:
+    """Split a changed value into one `(path, formatted value)` per line.
+
+    Args:
+        path (str): the path of the value (within its namelist).
+        value (Any): the new value. Dicts and lists (or NumPy arrays) are
+            split into their elements. `None` removes the variable.
+        sep (str, optional): the path separator. Defaults to "%".
+
+    Yields:
+        Tuple[str, str]: the path and the formatted value (None to remove the line).
+    """
+
+    if hasattr(value, "tolist"):
+        value = value.tolist()
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from _flatten_change(f"{path}{sep}{k}", v, sep)
+    elif isinstance(value, list):
+        for i, v in enumerate(value, 1):
+            yield from _flatten_change(f"{path}({i})", v, sep)
+    elif value is None:
+        yield path, None
+    else:
+        s = _format_value(value)
+        if s is None:
+            raise TypeError(f"can't write {type(value).__name__} value for {path}")
+        yield path, s
+
+
+###############################################################################
+def _group_changes(
+    changes: Dict[str, Any], sep: str = "%"
+) -> Dict[tuple, OrderedDict]:
+    """Sort the changes by namelist.
+
+    Args:
+        changes (Dict[str, Any]): the new values, by full path (e.g. `"group%a(2)"`,
+            or `"group(2)%a"` for the second `group` namelist in the file).
+        sep (str, optional): the path separator. Defaults to "%".
+
+    Returns:
+        Dict[tuple, OrderedDict]: for each `(group, occurrence)`, the
+            `(path, formatted value)` of each line, by compiled path.
+    """
+
+    groups = dict()
+    for full_path, value in changes.items():
+        group, _, path = full_path.partition(sep)
+        if not path:
+            raise ValueError(f"no namelist variable in path: {full_path}")
+        ((name, occurrence),) = _compile_path(group.strip(), sep)
+        lines = groups.setdefault((name, occurrence or 1), OrderedDict())
+        for line_path, s in _flatten_change(path.strip(), value, sep):
+            lines[_compile_path(line_path, sep)] = (line_path, s)
+    return groups
+
+
+###############################################################################
+def _patch_group(
+    text: str, offset: int, lines: OrderedDict, newline: str = "\n"
+) -> List[Tuple[int, int, bytes]]:
+    """Find the edits for one namelist.
+
+    Args:
+        text (str): the namelist text, decoded as latin-1 (so that the
+            indices are the byte indices).
+        offset (int): the index of the namelist in the file.
+        lines (OrderedDict): the `(path, formatted value)` of each changed line,
+            by compiled path.
+        newline (str, optional): the line ending of the new lines. Defaults to "\n".
+
+    Raises:
+        ValueError: the namelist is not in the simple format (values on the `&` line,
+            or no `/` line).
+
+    Returns:
+        List[Tuple[int, int, bytes]]: the `(start, end, replacement)` of each edit.
+    """
+
+    header_end = text.find("\n")
+    header = text[: len(text) if header_end < 0 else header_end].rstrip("\r")
+    if header_end < 0 or not _patch_header_rg.match(header):
+        raise ValueError(f"can't patch namelist, values on its first line: {header}")
+
+    edits = list()
+    found = set()
+    end = None
+    for m in _line_rg.finditer(text, header_end + 1):
+        path, _, other = m.groups()
+        if path is not None:
+            steps = _compile_path(path)
+            if steps in lines:
+                found.add(steps)
+                s = lines[steps][1]
+                if s is None:  # remove the whole line
+                    start, stop = m.start(), min(m.end() + 1, len(text))
+                    edits.append((start, stop, b""))
+                else:
+                    # only the value: the comment (if any) is kept
+                    start = m.start(2)
+                    value = _patch_value_rg.match(text, start).group()
+                    stop = start + len(value.rstrip())
+                    edits.append((start, stop, f"{s},".encode(_encoding)))
+        elif other and other[0] == "/":
+            end = m.start()
+            break
+    if end is None:
+        raise ValueError(f"can't patch namelist, no '/' line: {header}")
+
+    # new variables go at the end of the namelist
+    new = [
+        f" {p.lower()} = {s},{newline}"
+        for k, (p, s) in lines.items()
+        if s is not None and k not in found
+    ]
+    if new:
+        edits.append((end, end, "".join(new).encode(_encoding)))
+
+    return [(start + offset, stop + offset, b) for start, stop, b in edits]
+
+
+###############################################################################
+def _find_patch_edits(buf, changes: Dict[str, Any]) -> List[Tuple[int, int, bytes]]:
+    """Find the edits for all the changes (see `patch_namelist`)."""
+
+    groups = _group_changes(changes)
+    edits = list()
+    occurrences = dict()
+    # the new lines have the same line ending as the first line of the file
+    first = buf.find(b"\n")
+    newline = "\r\n" if first > 0 and buf[first - 1 : first] == b"\r" else "\n"
+    for start, end in _split_namelist_text(buf):
+        name = _group_name(buf, start)
+        occurrences[name] = occurrences.get(name, 0) + 1
+        lines = groups.pop((name, occurrences[name]), None)
+        if lines is not None:
+            text = buf[start:end].decode("latin-1")
+            edits.extend(_patch_group(text, start, lines, newline))
+
+    # namelists not in the file are appended to it
+    tail = list()
+    for (name, _), lines in groups.items():
+        new = [
+            f" {p.lower()} = {s},{newline}"
+            for p, s in lines.values()
+            if s is not None
+        ]
+        tail.append(f"&{name}{newline}{''.join(new)}/{newline}{newline}")
+    if tail:
+        prefix = newline if len(buf) and buf[-1:] != b"\n" else ""
+        tail = (prefix + "".join(tail)).encode(_encoding)
+        edits.append((len(buf), len(buf), tail))
+
+    return sorted(edits, key=lambda e: e[0])
+
+
+###############################################################################
+def _splice(buf, edits: List[Tuple[int, int, bytes]], f) -> None:
+    """Write the file contents with the edits applied."""
+
+    pos = 0
+    with memoryview(buf) as view:
+        for start, stop, b in edits:
+            f.write(view[pos:start])
+            f.write(b)
+            pos = stop
+        f.write(view[pos:])
+
+
+###############################################################################
+def patch_namelist(filename: str, changes: Dict[str, Any], output: str = None) -> int:
+    """Change some variables in an existing namelist file, without rewriting
+    the rest of it.
+
+    Only the namelists with changes are scanned, and only the changed lines
+    are rewritten (keeping the rest of the file as it is). The file is expected
+    to be in the simple format (one value per line), e.g. as written by
+    `save_namelist`.
+
+    When the new values have the same length as the old ones (e.g., floats
+    written by `save_namelist`), the file is updated in place. Otherwise,
+    it is rewritten through a temporary file.
+
+    Args:
+        filename (str): the namelist file.
+        changes (Dict[str, Any]): the new values, by full path, e.g.
+            `{"group%a(2)%b": 1.0}`. Use `"group(2)%..."` for the second
+            `group` namelist in the file. Variables that are not in the namelist
+            are added to the end of it, and namelists that are not in the file
+            are added to the end of the file. A `None` value removes the variable.
+        output (str, optional): the file to write the result to. Defaults to
+            None (change `filename`).
+
+    Raises:
+        ValueError: a namelist to change is not in the simple format
+            (values on the `&` line, or no `/` line).
+
+    Returns:
+        int: the number of edits.
+    """
+
+    with _map_namelist_file(filename) as buf:
+        edits = _find_patch_edits(buf, changes)
+        in_place = output is None and all(
+            stop - start == len(b) for start, stop, b in edits
+        )
+        if output is not None:
+            with open(output, "wb") as f:
+                _splice(buf, edits, f)
+        elif not in_place:
+            directory = os.path.dirname(os.path.abspath(filename))
+            with tempfile.NamedTemporaryFile(dir=directory, delete=False) as f:
+                try:
+                    _splice(buf, edits, f)
+                except BaseException:
+                    f.close()
+                    os.remove(f.name)
+                    raise
+
+    if in_place:
+        # same size: only overwrite the changed bytes
+        with open(filename, "r+b") as f:
+            for start, _, b in edits:
+                f.seek(start)
+                f.write(b)
+    elif output is None:
+        shutil.copymode(filename, f.name)
+        os.replace(f.name, filename)
+
+    return len(edits)
@@ -40,6 +40,7 @@ setup(
     ],
     keywords="namelist fortran",
     packages=find_packages(exclude=["docs", "tests"]),
-    python_requires=">=3.6",
+    python_requires=">=3.9",
     install_requires=["f90nml>=1.1.0"],
+    extras_require={"numpy": ["numpy"]},
 )
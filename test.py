@@ -1,10 +1,22 @@
 """ test cases """
 
 import os
+import asyncio
+import importlib.util
+import tempfile
 import unittest
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from timeit import timeit
 import f90nml
-from fastnml import read_namelist, save_namelist
+import fastnml.cache
+from fastnml import read_namelist, read_namelists, iter_namelist, save_namelist
+from fastnml import patch_namelist, fallback_info, clear_fallback_info
+from fastnml import ReadStats, WriteStats, CompactNamelist
+from fastnml import NamelistReader, ParseCache, path_cache_info, clear_path_cache
+from fastnml.reader import _pathSet, _scan_namelist, _read_single_namelist
+from fastnml.reader import _chunk_spans, _compile_path, _array_sizes
+from fastnml.reader import _nml_value_to_python_value, _to_dict
 
 
 def read_from_file_f90nml(filename, n_threads, parser):
@@ -114,6 +126,779 @@ class TestFastnml(unittest.TestCase):
 
         run_read_tests(filenames, tests, parser, repeats)
 
+    def test_path_cache(self):
+        """
+        Repeated path shapes are compiled once and reused.
+        """
+
+        clear_path_cache()
+        nml = {}
+        for _ in range(3):
+            _pathSet(nml, "c%a(2)%b", 1.0)
+        _pathSet(nml, "x", 2)
+        self.assertEqual(nml["c"]["a"][1]["b"], 1.0)
+        self.assertIsNone(nml["c"]["a"][0])
+        self.assertEqual(nml["x"], 2)
+        info = path_cache_info()
+        self.assertEqual(info.misses, 2)
+        self.assertEqual(info.hits, 2)
+        clear_path_cache()
+        self.assertEqual(path_cache_info().currsize, 0)
+
+    def test_scan_namelist(self):
+        """
+        The single-pass scanner yields one record per value line.
+        """
+
+        text = "&NML\n a = 1,\n ! comment\n\n c%a(2)%b = 'x',\n/\n"
+        records = list(_scan_namelist(text))
+        self.assertEqual(
+            records,
+            [("nml", None, None), ("nml", "a", "1"), ("nml", "c%a(2)%b", "'x'")],
+        )
+        nml = _read_single_namelist(text, f90nml.Parser(), True)
+        self.assertEqual(nml["nml"]["c"]["a"][1]["b"], "x")
+
+        # lines continuing a list are not supported by the scanner, so f90nml is used:
+        text = "&nml\n a = 1,\n 2\n/\n"
+        with self.assertRaises(Exception):
+            list(_scan_namelist(text))
+        nml = _read_single_namelist(text, f90nml.Parser(), True)
+        self.assertEqual(nml["nml"]["a"], [1, 2])
+
+    def test_mmap(self):
+        """
+        Memory-mapped reads give the same result as the default reader.
+        """
+
+        filename = os.path.join("tests", "test4b.nml")
+        nml = read_namelist(filename)
+        self.assertEqual(read_namelist(filename, use_mmap=True), nml)
+        self.assertEqual(read_namelist(filename, use_mmap=True, n_threads=2), nml)
+
+    def test_chunk_spans(self):
+        """
+        Small namelists are batched into ordered chunks for the workers.
+        """
+
+        spans = [(i * 1000, (i + 1) * 1000) for i in range(200)]
+        chunks = _chunk_spans(spans, 2)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual([s for c in chunks for s in c], spans)
+
+        # fixed-size chunks (when streaming)
+        for n in [200, 2000]:
+            spans = [(i * 1000, (i + 1) * 1000) for i in range(n)]
+            chunks = _chunk_spans(spans, 2, chunk_bytes=10000)
+            self.assertEqual(len(chunks), n // 10)
+            self.assertEqual([s for c in chunks for s in c], spans)
+
+    def test_reader(self):
+        """
+        A `NamelistReader` reuses its workers for many reads.
+        """
+
+        filenames = [os.path.join("tests", f) for f in ["test4b.nml", "test4c.nml"]]
+        expected = [read_namelist(f) for f in filenames]
+        for backend in ["process", "thread", "inline"]:
+            with NamelistReader(2, backend=backend) as reader:
+                self.assertEqual(reader.read(filenames[0]), expected[0])
+                self.assertEqual(reader.read_many(filenames), expected)
+        with self.assertRaises(ValueError):
+            NamelistReader(2, backend="gpu")
+
+    def test_read_namelists(self):
+        """
+        Read many files, with the per-file error policies.
+        """
+
+        filenames = [
+            os.path.join("tests", "test4b.nml"),
+            os.path.join("tests", "missing.nml"),
+        ]
+        expected = read_namelist(filenames[0])
+        for backend in ["process", "thread", "inline"]:
+            results = dict(
+                read_namelists(
+                    filenames,
+                    n_threads=2,
+                    backend=backend,
+                    ordered=False,
+                    errors="return",
+                )
+            )
+            self.assertEqual(results[filenames[0]], expected)
+            self.assertIsInstance(results[filenames[1]], FileNotFoundError)
+            results = list(read_namelists(filenames, backend=backend, errors="skip"))
+            self.assertEqual(results, [(filenames[0], expected)])
+            with self.assertRaises(FileNotFoundError):
+                list(read_namelists(filenames, n_threads=2, backend=backend))
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "requires numpy")
+    def test_as_numpy(self):
+        """
+        Numeric arrays can be returned as NumPy arrays, and written back.
+        """
+
+        import numpy as np
+
+        filename = "numpy.nml"
+        d = {"nml": {"a": np.array([1.0, 2.5]), "b": [1, None, 3], "s": ["x", "y"]}}
+        save_namelist(d, filename)
+        nml = read_namelist(filename, as_numpy=True)
+        os.remove(filename)
+
+        self.assertIsInstance(nml["nml"]["a"], np.ndarray)
+        self.assertEqual(nml["nml"]["a"].tolist(), [1.0, 2.5])
+        self.assertIsInstance(nml["nml"]["b"], np.ma.MaskedArray)
+        self.assertEqual(nml["nml"]["b"].tolist(), [1, None, 3])
+        self.assertEqual(nml["nml"]["s"], ["x", "y"])
+
+    def test_presize(self):
+        """
+        Arrays written high-index-first are allocated once.
+        """
+
+        text = "&nml\n c%a(3)%b(2) = 1\n c%a(1)%b(4) = 2\n d(5) = 3\n d(1) = 4\n/\n"
+        paths = [_compile_path(p) for _, p, _ in _scan_namelist(text) if p]
+        self.assertEqual(
+            _array_sizes(paths),
+            {
+                (("c", None), ("a", None)): 3,
+                (("c", None), ("a", 3), ("b", None)): 2,
+                (("c", None), ("a", 1), ("b", None)): 4,
+                (("d", None),): 5,
+            },
+        )
+        parser = f90nml.Parser()
+        nml = _read_single_namelist(text, parser, True, presize=True)
+        self.assertEqual(nml, _read_single_namelist(text, parser, True))
+        self.assertEqual(nml["nml"]["d"], [4, None, None, None, 3])
+
+    def test_schema(self):
+        """
+        Values are decoded by type, with or without a schema.
+        """
+
+        for value, expected in [
+            ("1", 1),
+            ("-1.5", -1.5),
+            ("1.0d0", 1.0),
+            (".5", 0.5),
+            (".true.", True),
+            ("F", False),
+            ("'it''s'", "it's"),
+        ]:
+            self.assertEqual(_nml_value_to_python_value(value), expected)
+            self.assertIs(type(_nml_value_to_python_value(value)), type(expected))
+
+        text = "&nml\n a = 1\n b(1) = 2\n b(2) = 3\n s = 'x'\n/\n"
+        parser = f90nml.Parser()
+        schema = (("a", float), ("b(*)", float))
+        nml = _read_single_namelist(text, parser, True, schema=schema)
+        self.assertIs(type(nml["nml"]["a"]), float)
+        self.assertEqual(nml["nml"]["b"], [2.0, 3.0])
+        self.assertEqual(nml["nml"]["s"], "x")
+
+        # a value that doesn't match the schema falls back to f90nml:
+        nml = _read_single_namelist(text, parser, True, schema=(("s", int),))
+        self.assertEqual(nml["nml"]["s"], "x")
+
+        # so does a line without values:
+        for line in [" b = \n", " b = ,\n"]:
+            text = f"&g\n a = 1\n{line}/\n"
+            nml = _read_single_namelist(text, parser, True, schema=(("b", int),))
+            self.assertEqual(nml, parser.reads(text))
+            self.assertIsNone(nml["g"]["b"])
+
+    def test_lazy(self):
+        """
+        A lazy read only parses the namelists that are accessed.
+        """
+
+        filename = os.path.join("tests", "test4c.nml")
+        nml = read_namelist(filename, lazy=True)
+        self.assertEqual(list(nml), ["example"])
+        self.assertEqual(nml.parsed, [])
+        self.assertIn("EXAMPLE", nml)
+        self.assertEqual(len(nml["example"]), 112)
+        self.assertEqual(nml.parsed, ["example"])
+        self.assertEqual(nml.to_namelist(), read_namelist(filename))
+
+    def test_cache(self):
+        """
+        Parsed files are served from the on-disk cache until they change.
+        """
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ParseCache(os.path.join(directory, "cache"))
+            filename = os.path.join(directory, "cached.nml")
+            save_namelist({"nml": {"a": 1, "b": [1.0, 2.0]}}, filename)
+
+            nml = read_namelist(filename, cache=cache)
+            self.assertEqual(read_namelist(filename, cache=cache), nml)
+            self.assertEqual(nml["nml"]["b"], [1.0, 2.0])
+
+            save_namelist({"nml": {"a": 2}}, filename)
+            os.utime(filename, ns=(0, 0))  # make sure the mtime changes
+            self.assertEqual(read_namelist(filename, cache=cache)["nml"]["a"], 2)
+
+            info = cache.info()
+            self.assertEqual((info.hits, info.misses, info.invalidations), (1, 2, 1))
+            self.assertEqual(info.entries, 2)
+            cache.clear()
+            self.assertEqual(cache.info().entries, 0)
+
+            # the entries of another version are not used
+            read_namelist(filename, cache=cache)
+            version = fastnml.cache.__version__
+            try:
+                fastnml.cache.__version__ = "0.0.0"
+                read_namelist(filename, cache=cache)
+            finally:
+                fastnml.cache.__version__ = version
+            self.assertEqual(cache.info().entries, 2)
+
+            # from several threads at once
+            cache.clear()
+            cache.hits = cache.misses = 0
+            with ThreadPoolExecutor(8) as executor:
+                futures = [
+                    executor.submit(read_namelist, filename, cache=cache)
+                    for _ in range(32)
+                ]
+                for future in futures:
+                    self.assertEqual(future.result()["nml"]["a"], 2)
+            info = cache.info()
+            self.assertEqual(info.hits + info.misses, 32)
+            tmp = [f for f in os.listdir(cache.directory) if f.endswith(".tmp")]
+            self.assertEqual(tmp, [])
+
+    def test_iter_namelist(self):
+        """
+        Namelists are yielded one at a time, in order.
+        """
+
+        filename = os.path.join("tests", "test4b.nml")
+        expected = read_namelist(filename)["example"]
+        for n_threads in [0, 2]:
+            groups = list(iter_namelist(filename, n_threads=n_threads))
+            self.assertEqual([k for k, _ in groups], ["example"] * len(expected))
+            self.assertEqual([v for _, v in groups], expected)
+
+        # at most one chunk per worker is parsed ahead
+        for backend in ["process", "thread"]:
+            with NamelistReader(2, backend=backend) as reader:
+                submitted = list()
+                submit = reader._submit
+                reader._submit = lambda *args: submitted.append(1) or submit(*args)
+                groups = reader.iter_groups(filename)
+                next(groups)
+                self.assertLessEqual(len(submitted), 2)
+                self.assertEqual(len(list(groups)) + 1, len(expected))
+                self.assertGreater(len(submitted), 2)
+
+    def test_writer(self):
+        """
+        Arrays are formatted in bulk, across several write chunks.
+        """
+
+        n = 20000  # more than one chunk of lines
+        d = {
+            "group": {
+                "x": [float(i) for i in range(n)],
+                "i": list(range(n)),
+                "s": ["it's", None, "b"],
+                "l": [True, False],
+                "p": [{"a": 1}, {"a": 2}],
+            }
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "w.nml")
+            save_namelist(d, filename)
+            with open(filename) as f:
+                text = f.read()
+            nml = read_namelist(filename)
+        self.assertIn(" x(20000) = 1.99990000000000000E+04,\n", text)
+        self.assertIn(" s(1) = 'it''s',\n s(3) = 'b',\n", text)
+        self.assertIn(" p(2)%a = 2,\n", text)
+        self.assertEqual(nml["group"]["x"], d["group"]["x"])
+        self.assertEqual(nml["group"]["i"], d["group"]["i"])
+        self.assertEqual(nml["group"]["s"], d["group"]["s"])
+        self.assertEqual(nml["group"]["l"], d["group"]["l"])
+        self.assertEqual(nml["group"]["p"][1]["a"], 2)
+
+    def test_writer_parallel(self):
+        """
+        The parallel writer gives the same output as the serial one.
+        """
+
+        import io
+        import fastnml.writer
+
+        d = {
+            "a": [{"x": [i / 7 for i in range(2500)], "n": {"m": [1, 2]}}] * 3,
+            "b": {"s": "text", "w": [{"p": i} for i in range(1500)], "t": 3},
+        }
+        size = fastnml.writer._elements_per_task
+        fastnml.writer._elements_per_task = 1000  # split the arrays
+        try:
+            outputs = []
+            for n_threads in [0, 2]:
+                f = io.StringIO()
+                save_namelist(d, f, n_threads=n_threads)
+                outputs.append(f.getvalue())
+        finally:
+            fastnml.writer._elements_per_task = size
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_patch_namelist(self):
+        """
+        Only the changed lines are rewritten.
+        """
+
+        d = {"g": {"a": 1.0, "b": [1, 2, 3], "c": {"d": "x"}}, "h": [{"x": 1}, {"x": 2}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "p.nml")
+            save_namelist(d, filename)
+            size = os.path.getsize(filename)
+
+            # same size: in place
+            self.assertEqual(patch_namelist(filename, {"g%a": 2.5, "G%B(2)": 7}), 2)
+            self.assertEqual(os.path.getsize(filename), size)
+
+            changes = {
+                "g%c%d": "longer",
+                "g%b(3)": None,  # removed
+                "g%e": True,  # added to g
+                "h(2)%x": 5,  # second h namelist
+                "k%z": [1, 2],  # new namelist
+            }
+            output = os.path.join(tmp, "q.nml")
+            patch_namelist(filename, changes, output)
+            patch_namelist(filename, changes)
+            with open(filename) as f1, open(output) as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+            nml = read_namelist(filename)
+        self.assertEqual(nml["g"]["a"], 2.5)
+        self.assertEqual(nml["g"]["b"], [1, 7])
+        self.assertEqual(nml["g"]["c"]["d"], "longer")
+        self.assertEqual(nml["g"]["e"], True)
+        self.assertEqual([h["x"] for h in nml["h"]], [1, 5])
+        self.assertEqual(nml["k"]["z"], [1, 2])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "c.nml")
+
+            # the comments and line endings are kept
+            with open(filename, "wb") as f:
+                f.write(b"&g ! header\r\n a = 1, ! keep\r\n s = 'x!y'\r\n/\r\n")
+            patch_namelist(filename, {"g%a": 5, "g%s": "z", "g%b": 2, "h%c": 3})
+            with open(filename, "rb") as f:
+                self.assertEqual(
+                    f.read(),
+                    b"&g ! header\r\n a = 5, ! keep\r\n s = 'z',\r\n b = 2,\r\n/\r\n"
+                    b"&h\r\n c = 3,\r\n/\r\n\r\n",
+                )
+
+            # not in the simple format
+            for text in ["&g a = 1 /\n", "&g\n a = 1 /\n"]:
+                with open(filename, "w") as f:
+                    f.write(text)
+                with self.assertRaises(ValueError):
+                    patch_namelist(filename, {"g%a": 2})
+
+    def test_refresh(self):
+        """
+        Only the namelists that changed are parsed again.
+        """
+
+        d = {"g": {"a": 1.0, "b": [1, 2, 3]}, "h": [{"x": 1}, {"x": 1}, {"x": 2}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "r.nml")
+            for n_threads in [0, 2]:
+                save_namelist(d, filename)
+                with NamelistReader(n_threads) as reader:
+                    nml1 = reader.refresh(filename)
+                    self.assertEqual(nml1, read_namelist(filename))
+                    self.assertIsNot(nml1["h"][0], nml1["h"][1])
+
+                    patch_namelist(filename, {"h(3)%x": 3})
+                    nml2 = reader.refresh(filename)
+                    self.assertEqual(nml2, read_namelist(filename))
+                    self.assertIs(nml2["g"], nml1["g"])  # reused
+                    self.assertIsNot(nml2["h"][2], nml1["h"][2])
+
+                    reader.forget(filename)
+                    self.assertIsNot(reader.refresh(filename)["g"], nml2["g"])
+
+    def test_hybrid(self):
+        """
+        Only the lines the simple parser can't read are sent to f90nml.
+        """
+
+        text = (
+            "&g\n a = 1,\n x(3:4) = 1, 2,\n s = 'a=b'\n y = 1,2,3\n"
+            " c%d(2)%e = 3.0\n z = 1,\n   2, 3,\n w = 5\n/\n"
+        )
+        parser = f90nml.Parser()
+        clear_fallback_info()
+        for node in [f90nml.Namelist, dict]:
+            nml = _read_single_namelist(text, parser, True, node=node, hybrid=True)
+            g = nml["g"]
+            self.assertIsInstance(g, node)
+            self.assertEqual(g["a"], 1)
+            self.assertEqual(g["s"], "a=b")
+            self.assertEqual(g["x"], [None, None, 1, 2])
+            self.assertEqual(g["y"], [1, 2, 3])
+            self.assertEqual(g["z"], [1, 2, 3])
+            self.assertEqual(g["c"]["d"][1]["e"], 3.0)
+            self.assertEqual(g["w"], 5)
+        self.assertEqual(fallback_info(), (2, 2, 0, 4))
+
+        nml = _read_single_namelist(text, parser, True)
+        self.assertEqual(nml, parser.reads(text))
+        self.assertEqual(fallback_info(), (3, 2, 1, 4))
+
+        # the indices of the f90nml lines are kept
+        text = (
+            "&g\n c%a(1)%b = 1\n c%a(2)%b = 2\n z = (1.0, 2.0)\n"
+            " c%a(3)%w = (3.0, 4.0)\n/\n"
+        )
+        g = _read_single_namelist(text, None, True, hybrid=True)["g"]
+        self.assertEqual(g["c"]["a"][0]["b"], 1)
+        self.assertEqual(g["c"]["a"][1]["b"], 2)
+        self.assertEqual(g["c"]["a"][2]["w"], 3.0 + 4.0j)
+        self.assertEqual(g["z"], 1.0 + 2.0j)
+
+        # the later lines override the f90nml ones
+        text = "&g\n x = 1, 2,\n 3, 4\n x(2) = 9\n/\n"
+        g = _read_single_namelist(text, None, True, hybrid=True)["g"]
+        self.assertEqual(g["x"], [1, 9, 3, 4])
+
+        # only the line with a null value is read by f90nml
+        clear_fallback_info()
+        text = "&g\n a = 1\n b = ,\n/\n"
+        g = _read_single_namelist(text, None, True, hybrid=True)["g"]
+        self.assertEqual((g["a"], g["b"]), (1, None))
+        self.assertEqual(fallback_info(), (1, 1, 0, 1))
+
+        # including the namelists read by the workers
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "h.nml")
+            with open(filename, "w") as f:
+                f.write(text * 3)
+            for backend in ["process", "thread"]:
+                clear_fallback_info()
+                with NamelistReader(2, backend=backend, hybrid=True) as reader:
+                    reader.read(filename)
+                self.assertEqual(fallback_info(), (3, 3, 0, 3))
+
+    def test_value_lists(self):
+        """
+        Lists of values, repeat counts and index ranges are read by the simple parser.
+        """
+
+        text = (
+            "&g\n a = 1, 2, 3,\n b = 1 2 3\n c(2:) = 3*0.0\n d(1:4) = 'x', 'y',\n"
+            " e(1:5:2) = .true., .false., T\n f = 'it''s', \"q\"\n s = 'a, b'\n"
+            " h = 2*, 5\n k%m(2:3) = 1.5d0 2.5\n/\n"
+        )
+        clear_fallback_info()
+        g = _read_single_namelist(text, f90nml.Parser(), True)["g"]
+        self.assertEqual(fallback_info().fallback, 0)
+        self.assertEqual(g["a"], [1, 2, 3])
+        self.assertEqual(g["b"], [1, 2, 3])
+        self.assertEqual(g["c"], [None, 0.0, 0.0, 0.0])
+        self.assertEqual(g["d"], ["x", "y"])
+        self.assertEqual(g["e"], [True, None, False, None, True])
+        self.assertEqual(g["f"], ["it's", "q"])
+        self.assertEqual(g["s"], "a, b")
+        self.assertEqual(g["h"], [None, None, 5])
+        self.assertEqual(g["k"]["m"], [None, 1.5, 2.5])
+
+        # too many values for the range
+        _read_single_namelist("&g\n a(1:2) = 1, 2, 3\n/\n", f90nml.Parser(), True)
+        self.assertEqual(fallback_info().fallback, 1)
+
+        # the same values as f90nml (with the arrays starting at 1)
+        parser = f90nml.Parser()
+        parser.global_start_index = 1
+        for line in ["x(3) = 2*7", "a(2) = 1, 2", "c%x(2) = 1 2", "x(2:3) = 1, 2"]:
+            text = f"&g\n {line}\n/\n"
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # f90nml: values not assigned
+                self.assertEqual(
+                    _read_single_namelist(text, parser, True), parser.reads(text)
+                )
+
+    def test_stats(self):
+        """
+        The statistics of the reads and writes.
+        """
+
+        d = {"a": {"x": [1.0, 2.0], "s": "q"}, "b": [{"y": 1}, {"y": 2}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "s.nml")
+            for n_threads in [0, 2]:
+                wstats = WriteStats()
+                save_namelist(d, filename, n_threads=n_threads, stats=wstats)
+                self.assertEqual((wstats.groups, wstats.lines), (3, 14))
+                self.assertEqual(wstats.chars, os.path.getsize(filename))
+                self.assertGreater(wstats.timings["format"], 0.0)
+
+                rstats = ReadStats()
+                read_namelist(filename, n_threads=n_threads, stats=rstats)
+                self.assertEqual((rstats.files, rstats.groups), (1, 3))
+                self.assertEqual((rstats.lines, rstats.fallbacks), (5, []))
+                self.assertGreater(rstats.timings["scan"], 0.0)
+                self.assertGreater(rstats.wall_time, 0.0)
+                if n_threads:
+                    self.assertTrue(1 <= len(rstats.workers) <= rstats.n_workers)
+                    self.assertGreater(rstats.utilization, 0.0)
+
+            with open(filename, "a") as f:
+                f.write("&c x=1 /\n")
+            rstats = ReadStats()
+            read_namelist(filename, stats=rstats)
+        self.assertEqual(rstats.fallbacks, [("c", "Exception: invalid line: &c x=1 /")])
+        self.assertEqual(rstats.as_dict()["fallback_groups"], 1)
+
+    def test_benchmark(self):
+        """
+        The synthetic namelists of the benchmarks, and the baseline comparison.
+        """
+
+        import benchmark
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "b.nml")
+            info = benchmark.generate_namelist(
+                filename,
+                n_groups=3,
+                n_arrays=4,
+                array_length=20,
+                depth=3,
+                value_types=benchmark._value_types,
+                fallback=0.1,
+            )
+            self.assertEqual(info["bytes"], os.path.getsize(filename))
+            nml = read_namelist(filename, hybrid=True)
+            # (the lines read by f90nml are added last, so compare as plain dicts)
+            self.assertEqual(_to_dict(nml), _to_dict(f90nml.read(filename)))
+            self.assertEqual(len(nml["group0"]["v1"][0]["v2"][0]["x0"]), 20)
+
+            results = benchmark.run_benchmarks(
+                [("small", dict(n_groups=2, array_length=10))],
+                threads=[0],
+                repeats=1,
+                directory=tmp,
+            )
+        self.assertEqual(
+            [r["name"] for r in results],
+            ["read/small/simple/0", "read/small/hybrid/0", "write/small/0"],
+        )
+        slower = [dict(r, seconds=r["seconds"] * 2) for r in results]
+        comparison = benchmark.compare(slower, results, threshold=0.5)
+        self.assertTrue(all(c["regression"] for c in comparison))
+
+    def test_deferred_imports(self):
+        """
+        Importing fastnml, and reading and writing with the simple parser,
+        don't import f90nml or multiprocessing.
+        """
+
+        import benchmark
+
+        results = benchmark.run_startup_benchmarks(repeats=1)
+        names = [r["name"] for r in results]
+        self.assertEqual(names, ["startup/import", "startup/read"])
+        for r in results:
+            self.assertEqual(r["deferred"], [])
+            self.assertGreater(r["import_seconds"], 0.0)
+
+    def test_split_size(self):
+        """
+        Large namelists are split into parts read by different workers.
+        """
+
+        text = "&big\n" + "".join(
+            f" c%a({i % 7 + 1})%b({i}) = {i},\n x({i}) = 'v{i}'\n"
+            for i in range(1, 2001)
+        )
+        text += " c%a(1)%b(1) = -1\n/\n&small\n a = 1\n/\n"
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "big.nml")
+            with open(filename, "w") as f:
+                f.write(text)
+            expected = read_namelist(filename)
+            self.assertEqual(expected["big"]["c"]["a"][0]["b"][0], -1)
+            for backend in ["process", "thread"]:
+                with NamelistReader(2, backend=backend, split_size=4096) as reader:
+                    self.assertEqual(reader.read(filename), expected)
+
+            # a part that needs f90nml: the whole namelist is read by f90nml
+            with open(filename, "a") as f:
+                f.write("&big\n" + " y = 1,\n 2\n" * 1000 + " z = 3\n/\n")
+            nml = read_namelist(filename, n_threads=2, split_size=4096)
+        self.assertEqual(nml["big"][1]["y"], [1, 2])
+        self.assertEqual(nml["big"][1]["z"], 3)
+
+    def test_async(self):
+        """
+        The asyncio API gives the same results as the blocking one.
+        """
+
+        import fastnml
+
+        text = "&a\n x = 1\n/\n&b\n y = 1,\n 2\n/\n&a\n x = 2\n/\n"
+
+        async def run(filename: str, output: str) -> None:
+            expected = read_namelist(filename)
+            nml = await fastnml.aread_namelist(filename)
+            self.assertEqual(nml, expected)
+
+            groups = [g async for g, _ in fastnml.aiter_namelist(filename)]
+            self.assertEqual(groups, ["a", "b", "a"])
+
+            # a larger file, in several chunks
+            large = os.path.join("tests", "test4b.nml")
+            groups = [v async for _, v in fastnml.aiter_namelist(large)]
+            self.assertEqual(groups, read_namelist(large)["example"])
+
+            filenames = [filename, "missing.nml", filename]
+            results = [
+                r
+                async for r in fastnml.aread_namelists(
+                    filenames, limit=1, errors="return"
+                )
+            ]
+            self.assertEqual([f for f, _ in results], filenames)
+            self.assertEqual(results[0][1], expected)
+            self.assertIsInstance(results[1][1], FileNotFoundError)
+            with self.assertRaises(FileNotFoundError):
+                async for _ in fastnml.aread_namelists(filenames):
+                    pass
+
+            await fastnml.asave_namelist(nml, output)
+            self.assertEqual(read_namelist(output), expected)
+
+            # each thread parses with its own copy of the parser
+            parser = f90nml.Parser()
+            nml = await fastnml.aread_namelist(filename, parser=parser, simple=False)
+            self.assertEqual(nml, expected)
+            groups = fastnml.aiter_namelist(filename, parser=parser, simple=False)
+            self.assertEqual([g async for g, _ in groups], ["a", "b", "a"])
+            self.assertIsNone(parser.token)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "async.nml")
+            with open(filename, "w") as f:
+                f.write(text)
+            try:
+                for backend in ["thread", "process"]:
+                    fastnml.configure_executor(backend, max_workers=2)
+                    asyncio.run(run(filename, os.path.join(tmp, "output.nml")))
+            finally:
+                fastnml.shutdown_executor()
+                fastnml.configure_executor()
+
+    def test_select(self):
+        """
+        Only the selected namelists and paths are read.
+        """
+
+        text = (
+            "&run\n dt = 0.1\n n = 10\n c%a(1)%b = 1\n c%a(2)%b = 2\n c%x = 3\n/\n"
+            "&output\n file = 'out.txt'\n every = 5\n/\n"
+            "&lists\n v = 1, 2,\n 3\n w = 4\n/\n"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "select.nml")
+            with open(filename, "w") as f:
+                f.write(text)
+
+            nml = read_namelist(filename, include=["run"])
+            self.assertEqual(list(nml), ["run"])
+            self.assertEqual(nml["run"]["n"], 10)
+
+            nml = read_namelist(filename, include=["RUN%c", "output%every"])
+            self.assertEqual(
+                _to_dict(nml["run"]), {"c": {"a": [{"b": 1}, {"b": 2}], "x": 3}}
+            )
+            self.assertEqual(_to_dict(nml["output"]), {"every": 5})
+
+            nml = read_namelist(filename, exclude=["run%c%a(*)", "output"])
+            self.assertEqual(list(nml), ["run", "lists"])
+            self.assertEqual(_to_dict(nml["run"]), {"dt": 0.1, "n": 10, "c": {"x": 3}})
+
+            # lines read by f90nml are filtered too
+            for hybrid in [False, True]:
+                nml = read_namelist(filename, include=["lists%w"], hybrid=hybrid)
+                self.assertEqual(_to_dict(nml), {"lists": {"w": 4}})
+                nml = read_namelist(filename, exclude=["lists%w"], hybrid=hybrid)
+                self.assertEqual(nml["lists"]["v"], [1, 2, 3])
+                self.assertNotIn("w", nml["lists"])
+
+            groups = [g for g, _ in iter_namelist(filename, exclude=["run"])]
+            self.assertEqual(groups, ["output", "lists"])
+            lazy = read_namelist(filename, lazy=True, include=["output"])
+            self.assertEqual(list(lazy), ["output"])
+            with NamelistReader(2, backend="thread", include=["*%dt"]) as reader:
+                self.assertEqual(reader.read(filename)["run"], {"dt": 0.1})
+
+            # elements of lists of values and index ranges
+            filename = os.path.join(tmp, "lists.nml")
+            with open(filename, "w") as f:
+                f.write("&run\n X(1:3) = 1,2,3\n y = 4, 5, 6\n z(2:) = 7, 8\n/\n")
+            nml = read_namelist(filename, include=["run%x(2)", "run%y(3)", "run%z(3)"])
+            self.assertEqual(
+                _to_dict(nml["run"]),
+                {"x": [None, 2], "y": [None, None, 6], "z": [None, None, 8]},
+            )
+            nml = read_namelist(filename, exclude=["run%x(2)", "run%z"])
+            self.assertEqual(_to_dict(nml["run"]), {"x": [1, None, 3], "y": [4, 5, 6]})
+
+    def test_compact(self):
+        """
+        Compact trees have the same values as `Namelist` trees, and are written the same.
+        """
+
+        text = (
+            "&run\n dt = 0.1\n c%a(1)%b = 1\n c%a(3)%b = 3\n c%a(2)%d%e = 'x'\n"
+            " c%a(2)%v(2) = 2.5\n c%a(2)%s(2)%t = 7\n x(2) = 4\n/\n"
+            "&run\n dt = 0.2\n/\n"
+            "&lists\n y = 1,\n 2\n/\n"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "compact.nml")
+            with open(filename, "w") as f:
+                f.write(text)
+            expected = read_namelist(filename)
+            for kwargs in [{}, {"hybrid": True}, {"n_threads": 2}]:
+                nml = read_namelist(filename, compact=True, **kwargs)
+                self.assertIsInstance(nml, CompactNamelist)
+                self.assertEqual(nml, expected)
+                self.assertEqual(nml.to_namelist(), expected)
+
+            a = nml["run"][0]["c"]["a"]
+            self.assertEqual(len(a), 3)
+            self.assertEqual(a.column("b"), [1, None, 3])
+            self.assertEqual(a[1]["d"]["e"], "x")
+            self.assertEqual(a[1]["s"][1]["t"], 7)
+            self.assertNotIn("b", a[1])
+            self.assertEqual(a[1:].column("b"), [None, 3])
+
+            output = os.path.join(tmp, "output.nml")
+            for n_threads in [0, 2]:
+                save_namelist(expected, output, n_threads=n_threads)
+                with open(output) as f:
+                    expected_text = f.read()
+                save_namelist(nml, output, n_threads=n_threads)
+                with open(output) as f:
+                    self.assertEqual(f.read(), expected_text)
+
 
 if __name__ == "__main__":
     unittest.main()